@@ -7,12 +7,17 @@ from flask import Flask, send_from_directory
 from flask_cors import CORS
 from flask_login import LoginManager
 from src.models.auth import db, User
+from src.models.schema import sync_schema
 from src.routes.user import user_bp
 from src.routes.campaign import campaign_bp
 from src.routes.messaging import messaging_bp
 from src.routes.social import social_bp
 from src.routes.crm import crm_bp
 from src.routes.auth import auth_bp
+from src.routes.jobs import jobs_bp
+from src.services.jobs import job_queue
+from src.services.rollups import rebuild_rollups_command
+from src.services.search import ensure_search_index, rebuild_search_index_command
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
@@ -46,6 +51,7 @@ app.register_blueprint(messaging_bp, url_prefix='/api')
 app.register_blueprint(social_bp, url_prefix='/api')
 app.register_blueprint(crm_bp, url_prefix='/api')
 app.register_blueprint(auth_bp, url_prefix='/api')
+app.register_blueprint(jobs_bp, url_prefix='/api')
 
 # Inicializar o banco de dados
 db.init_app(app)
@@ -53,6 +59,15 @@ db.init_app(app)
 # Criar as tabelas
 with app.app_context():
     db.create_all()
+    sync_schema()
+    ensure_search_index()
+
+# Iniciar a fila de tarefas em segundo plano
+job_queue.init_app(app)
+
+# Comandos de manutenção (flask --app src.main rebuild-rollups)
+app.cli.add_command(rebuild_rollups_command)
+app.cli.add_command(rebuild_search_index_command)
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -5,6 +5,12 @@ import json
 # Importar db do módulo de autenticação
 from .auth import db
 
+# Quantidade de clientes em cada grupo de disparo
+CUSTOMER_GROUP_SIZE = 300
+
+# Status de mensagens com resultado conhecido; 'pending' é só a reserva antes do envio
+MESSAGE_RESULT_STATUSES = ('sent', 'failed')
+
 class Campaign(db.Model):
     __tablename__ = 'campaigns'
     
@@ -24,6 +30,12 @@ class Campaign(db.Model):
 
 class Customer(db.Model):
     __tablename__ = 'customers'
+    __table_args__ = (
+        # Seleção de clientes por segmento em ordem estável de id
+        db.Index('ix_customers_segment_id', 'segment', 'id'),
+        # Paginação por cursor ordenada por nome
+        db.Index('ix_customers_name_id', 'name', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -48,14 +60,39 @@ class CampaignDispatch(db.Model):
     dispatch_number = db.Column(db.Integer, nullable=False)  # 1, 2 ou 3
     scheduled_date = db.Column(db.DateTime, nullable=False)
     sent_date = db.Column(db.DateTime)
-    status = db.Column(db.String(20), default='scheduled')  # scheduled, sent, failed
+    status = db.Column(db.String(20), default='scheduled')  # scheduled, running, sent, failed
     customers_count = db.Column(db.Integer, default=0)
     success_count = db.Column(db.Integer, default=0)
     failed_count = db.Column(db.Integer, default=0)
+    lease_owner = db.Column(db.String(100))  # worker executando o disparo
+    lease_expires_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class CampaignGroupMember(db.Model):
+    """Clientes de cada grupo de uma campanha, definidos no agendamento"""
+    __tablename__ = 'campaign_group_members'
+    __table_args__ = (
+        db.Index('ix_campaign_group_members_group', 'campaign_id', 'customer_group', 'customer_id', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'), nullable=False)
+    customer_group = db.Column(db.Integer, nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=False)
+
 class MessageLog(db.Model):
     __tablename__ = 'message_logs'
+    __table_args__ = (
+        # Junções de logs com clientes (análises por segmento e cliente)
+        db.Index('ix_message_logs_customer_id', 'customer_id'),
+        # Contagens por faixa de data de envio (séries e mensagens do dia)
+        db.Index('ix_message_logs_sent_date', 'sent_date'),
+        # Relatório de campanha: mensagens recentes e listagem por cursor
+        db.Index('ix_message_logs_campaign_created_at', 'campaign_id', 'created_at'),
+        db.Index('ix_message_logs_campaign_id_id', 'campaign_id', 'id'),
+        # Checkpoint do disparo: um log por cliente, para retomar sem reenviar
+        db.Index('ux_message_logs_dispatch_customer', 'dispatch_id', 'customer_id', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'), nullable=False)
@@ -68,5 +105,33 @@ class MessageLog(db.Model):
     status = db.Column(db.String(20), default='pending')  # pending, sent, delivered, failed
     whatsapp_message_id = db.Column(db.String(100))
     error_message = db.Column(db.Text)
+    segment = db.Column(db.String(50))  # segmento do cliente no envio; '' sem segmento, nulo em logs antigos
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+
+class CampaignMessageRollup(db.Model):
+    """Contagem de mensagens por campanha, disparo e status"""
+    __tablename__ = 'campaign_message_rollups'
+    __table_args__ = (
+        db.Index('ix_campaign_message_rollups_key', 'campaign_id', 'dispatch_id', 'status', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'), nullable=False)
+    dispatch_id = db.Column(db.Integer, db.ForeignKey('campaign_dispatches.id'), nullable=False)
+    dispatch_number = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+
+class SegmentDailyRollup(db.Model):
+    """Contagem de mensagens por segmento do cliente, dia e status"""
+    __tablename__ = 'segment_daily_rollups'
+    __table_args__ = (
+        db.Index('ix_segment_daily_rollups_key', 'day', 'segment', 'status', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    segment = db.Column(db.String(50), nullable=False, default='')  # '' para clientes sem segmento
+    day = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,44 @@
+import json
+from datetime import datetime
+
+# Importar db do módulo de autenticação
+from .auth import db
+
+class BackgroundJob(db.Model):
+    """Tarefa executada fora da requisição HTTP pela fila de jobs"""
+    __tablename__ = 'background_jobs'
+    __table_args__ = (
+        db.Index('ix_background_jobs_status_created', 'status', 'created_at'),
+    )
+    
+    id = db.Column(db.String(36), primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), default='queued')  # queued, running, succeeded, failed, cancelled
+    payload = db.Column(db.Text)  # JSON com os parâmetros da tarefa
+    progress = db.Column(db.Text)  # JSON com o último progresso informado
+    result = db.Column(db.Text)  # JSON com o resultado final
+    error_message = db.Column(db.Text)
+    cancel_requested = db.Column(db.Boolean, default=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    worker_id = db.Column(db.String(100))
+    node = db.Column(db.String(100))  # host que deve executar a tarefa; vazio para qualquer um
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        """Converte a tarefa para dicionário"""
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'payload': json.loads(self.payload) if self.payload else None,
+            'progress': json.loads(self.progress) if self.progress else None,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error_message,
+            'cancel_requested': bool(self.cancel_requested),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -0,0 +1,47 @@
+import logging
+from sqlalchemy import inspect
+from sqlalchemy.exc import SQLAlchemyError
+from .auth import db
+
+logger = logging.getLogger(__name__)
+
+def _add_missing_columns(table, inspector):
+    """Adicionar colunas novas e anuláveis que ainda não existem na tabela"""
+    existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+    
+    for column in table.columns:
+        if column.name in existing_columns:
+            continue
+        
+        if not column.nullable:
+            logger.error(f"Coluna obrigatória {table.name}.{column.name} ausente; crie-a manualmente")
+            continue
+        
+        column_type = column.type.compile(dialect=db.engine.dialect)
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            logger.info(f"Coluna {table.name}.{column.name} adicionada")
+        except SQLAlchemyError as e:
+            logger.error(f"Erro ao adicionar coluna {table.name}.{column.name}: {str(e)}")
+
+def sync_schema():
+    """Completar o schema de bancos criados antes de novas colunas e índices
+
+    O db.create_all() só cria tabelas ausentes; colunas anuláveis e índices
+    adicionados aos modelos depois que a tabela já existe são criados aqui.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        
+        _add_missing_columns(table, inspector)
+        
+        for index in table.indexes:
+            try:
+                index.create(bind=db.engine, checkfirst=True)
+            except SQLAlchemyError as e:
+                logger.error(f"Erro ao criar índice {index.name}: {str(e)}")
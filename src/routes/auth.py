@@ -1,11 +1,18 @@
 from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash
 from flask_login import login_user, logout_user, login_required, current_user
 from src.models.auth import User, db
+from src.services.pagination import paginate_query, PaginationError
 from datetime import datetime
 import re
 
 auth_bp = Blueprint('auth', __name__)
 
+# Chaves de ordenação aceitas na paginação por cursor de usuários
+USER_SORT_KEYS = {
+    'id': [User.id],
+    'username': [User.username, User.id]
+}
+
 def validate_email(email):
     """Valida formato de email"""
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
@@ -310,8 +317,6 @@ def list_users():
                 'error': 'Acesso negado'
             }), 403
         
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         search = request.args.get('search', '').strip()
         
         query = User.query
@@ -323,25 +328,19 @@ def list_users():
                 (User.full_name.ilike(f'%{search}%'))
             )
         
-        users = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        users, pagination = paginate_query(query, request.args, USER_SORT_KEYS, default_per_page=20)
         
         return jsonify({
             'success': True,
-            'users': [user.to_dict() for user in users.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': users.total,
-                'pages': users.pages,
-                'has_next': users.has_next,
-                'has_prev': users.has_prev
-            }
+            'users': [user.to_dict() for user in users],
+            'pagination': pagination
         })
         
+    except PaginationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -1,14 +1,47 @@
-from flask import Blueprint, request, jsonify
-from src.models.user import db
-from src.models.campaign import Campaign, Customer, CampaignDispatch, MessageLog
-import pandas as pd
-import io
+from flask import Blueprint, request, jsonify, url_for
+from flask_login import current_user
+from src.models.auth import db
+from src.models.campaign import Campaign, Customer, CampaignDispatch, MessageLog, CampaignGroupMember, CUSTOMER_GROUP_SIZE
+from src.services.customer_import import CustomerImporter
+from src.services.jobs import job_queue
+from src.services.crm import campaign_scheduler
+from src.services.cache import response_cache, CAMPAIGNS_TAG, CUSTOMERS_TAG, DISPATCHES_TAG
+from src.services.templates import compile_template, validate_template, TemplateError, TEMPLATE_VARIABLES
 import json
+import tempfile
 from datetime import datetime, timedelta
 import os
 
 campaign_bp = Blueprint('campaign', __name__)
 
+# Diretório onde os CSVs aguardam a tarefa de importação
+IMPORT_UPLOAD_DIR = os.getenv('IMPORT_UPLOAD_DIR', tempfile.gettempdir())
+# Com o diretório em armazenamento compartilhado, qualquer host pode importar;
+# senão a tarefa fica fixada no host que recebeu o arquivo
+IMPORT_UPLOAD_SHARED = os.getenv('IMPORT_UPLOAD_SHARED', '').lower() in ('1', 'true')
+
+def _run_import_job(context):
+    """Tarefa em segundo plano de importação de clientes"""
+    path = context.payload['path']
+    importer = CustomerImporter(user_id=context.payload.get('user_id'))
+    
+    def on_progress(stats):
+        context.update_progress(stats)
+        context.check_cancelled()
+    
+    try:
+        with open(path, 'rb') as f:
+            return importer.import_stream(f, progress_callback=on_progress)
+    finally:
+        os.remove(path)
+
+def _discard_import_upload(payload):
+    """Apagar o CSV de uma importação cancelada antes de começar"""
+    if os.path.exists(payload['path']):
+        os.remove(payload['path'])
+
+job_queue.register('import_customers', _run_import_job, on_cancel=_discard_import_upload)
+
 @campaign_bp.route('/campaigns', methods=['GET'])
 def get_campaigns():
     """Listar todas as campanhas"""
@@ -27,6 +60,12 @@ def create_campaign():
     """Criar nova campanha"""
     data = request.get_json()
     
+    # Validar variáveis do template antes de salvar
+    try:
+        validate_template(data['message_template'])
+    except TemplateError as e:
+        return jsonify({'error': str(e)}), 400
+    
     campaign = Campaign(
         name=data['name'],
         message_template=data['message_template'],
@@ -37,12 +76,42 @@ def create_campaign():
     
     db.session.add(campaign)
     db.session.commit()
+    response_cache.invalidate(CAMPAIGNS_TAG)
     
     return jsonify({
         'id': campaign.id,
         'message': 'Campanha criada com sucesso'
     }), 201
 
+@campaign_bp.route('/campaigns/<int:campaign_id>/preview', methods=['GET'])
+def preview_campaign(campaign_id):
+    """Pré-visualizar mensagens personalizadas de uma campanha"""
+    campaign = Campaign.query.get_or_404(campaign_id)
+    limit = min(request.args.get('limit', 5, type=int), 50)
+    
+    try:
+        template = compile_template(campaign.message_template, campaign.coupon_code)
+    except TemplateError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    query = Customer.query
+    if campaign.target_segment and campaign.target_segment != 'all':
+        query = query.filter(Customer.segment == campaign.target_segment)
+    
+    customers = query.order_by(Customer.id).limit(limit).all()
+    messages = template.render_many(customers)
+    
+    return jsonify({
+        'campaign_id': campaign.id,
+        'variables': template.variables,
+        'previews': [{
+            'customer_id': c.id,
+            'name': c.name,
+            'phone': c.phone,
+            'message': message
+        } for c, message in zip(customers, messages)]
+    })
+
 @campaign_bp.route('/customers/import', methods=['POST'])
 def import_customers():
     """Importar clientes via CSV"""
@@ -56,66 +125,35 @@ def import_customers():
     if not file.filename.endswith('.csv'):
         return jsonify({'error': 'Arquivo deve ser CSV'}), 400
     
+    path = None
     try:
-        # Ler CSV
-        stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-        df = pd.read_csv(stream)
-        
-        # Validar colunas obrigatórias
-        required_columns = ['name', 'phone']
-        if not all(col in df.columns for col in required_columns):
-            return jsonify({
-                'error': f'Colunas obrigatórias: {required_columns}. Encontradas: {list(df.columns)}'
-            }), 400
-        
-        imported_count = 0
-        updated_count = 0
+        # Guardar o arquivo para a tarefa em segundo plano
+        fd, path = tempfile.mkstemp(prefix='import-', suffix='.csv', dir=IMPORT_UPLOAD_DIR)
+        with os.fdopen(fd, 'wb') as upload:
+            file.save(upload)
         
-        for _, row in df.iterrows():
-            # Verificar se cliente já existe
-            existing_customer = Customer.query.filter_by(phone=row['phone']).first()
-            
-            if existing_customer:
-                # Atualizar dados existentes
-                existing_customer.name = row['name']
-                existing_customer.email = row.get('email', existing_customer.email)
-                existing_customer.location = row.get('location', existing_customer.location)
-                existing_customer.average_ticket = float(row.get('average_ticket', existing_customer.average_ticket or 0))
-                existing_customer.order_frequency = int(row.get('order_frequency', existing_customer.order_frequency or 0))
-                existing_customer.preferred_items = row.get('preferred_items', existing_customer.preferred_items)
-                existing_customer.updated_at = datetime.utcnow()
-                updated_count += 1
-            else:
-                # Criar novo cliente
-                customer = Customer(
-                    name=row['name'],
-                    phone=row['phone'],
-                    email=row.get('email'),
-                    location=row.get('location'),
-                    average_ticket=float(row.get('average_ticket', 0)),
-                    order_frequency=int(row.get('order_frequency', 0)),
-                    preferred_items=row.get('preferred_items')
-                )
-                db.session.add(customer)
-                imported_count += 1
-        
-        # Segmentar clientes após importação
-        _segment_customers()
-        
-        db.session.commit()
+        user_id = current_user.id if current_user.is_authenticated else None
+        job_id = job_queue.enqueue(
+            'import_customers',
+            {'path': path, 'filename': file.filename, 'user_id': user_id},
+            user_id=user_id,
+            pin_to_node=not IMPORT_UPLOAD_SHARED
+        )
         
         return jsonify({
-            'message': 'Importação concluída',
-            'imported': imported_count,
-            'updated': updated_count,
-            'total': imported_count + updated_count
-        })
+            'message': 'Importação iniciada',
+            'job_id': job_id,
+            'status_url': url_for('jobs.get_job', job_id=job_id)
+        }), 202
         
     except Exception as e:
         db.session.rollback()
+        if path and os.path.exists(path):
+            os.remove(path)
         return jsonify({'error': f'Erro ao processar arquivo: {str(e)}'}), 500
 
 @campaign_bp.route('/customers/segments', methods=['GET'])
+@response_cache.cached(tags=(CUSTOMERS_TAG,))
 def get_customer_segments():
     """Obter estatísticas de segmentação de clientes"""
     segments = db.session.query(
@@ -140,20 +178,38 @@ def schedule_campaign(campaign_id):
     target_segment = data.get('target_segment', campaign.target_segment)
     
     # Buscar clientes do segmento
-    query = Customer.query
+    segment_filter = db.true()
     if target_segment and target_segment != 'all':
-        query = query.filter(Customer.segment == target_segment)
+        segment_filter = Customer.segment == target_segment
     
-    customers = query.all()
+    total_customers = db.session.query(Customer.id).filter(segment_filter).count()
     
-    if not customers:
+    if not total_customers:
         return jsonify({'error': 'Nenhum cliente encontrado para o segmento'}), 400
     
-    # Dividir em grupos de 300
-    groups = [customers[i:i+300] for i in range(0, len(customers), 300)]
+    # Materializar os grupos de 300 em ordem de id, direto no banco
+    group_number = (db.func.row_number().over(order_by=Customer.id) - 1) // CUSTOMER_GROUP_SIZE + 1
+    members = db.select(
+        Customer.id,
+        db.literal(campaign_id),
+        group_number
+    ).where(segment_filter)
+    
+    CampaignGroupMember.query.filter_by(campaign_id=campaign_id).delete()
+    db.session.execute(
+        db.insert(CampaignGroupMember).from_select(
+            ['customer_id', 'campaign_id', 'customer_group'],
+            members
+        )
+    )
+    
+    groups_count = (total_customers + CUSTOMER_GROUP_SIZE - 1) // CUSTOMER_GROUP_SIZE
     
     # Criar disparos programados
-    for group_index, group in enumerate(groups):
+    dispatches = []
+    for group_index in range(groups_count):
+        group_size = min(CUSTOMER_GROUP_SIZE, total_customers - group_index * CUSTOMER_GROUP_SIZE)
+        
         for dispatch_number in range(1, 4):  # 3 disparos
             dispatch_date = start_date + timedelta(days=(dispatch_number - 1) * 2)
             
@@ -162,35 +218,27 @@ def schedule_campaign(campaign_id):
                 customer_group=group_index + 1,
                 dispatch_number=dispatch_number,
                 scheduled_date=dispatch_date,
-                customers_count=len(group)
+                customers_count=group_size
             )
             db.session.add(dispatch)
+            dispatches.append(dispatch)
     
     campaign.status = 'active'
+    db.session.flush()
+    scheduled = [(d.id, d.scheduled_date) for d in dispatches]
     db.session.commit()
+    response_cache.invalidate(CAMPAIGNS_TAG, DISPATCHES_TAG)
+    
+    # Acordar o agendador para os novos disparos
+    campaign_scheduler.notify_scheduled(scheduled)
     
     return jsonify({
         'message': 'Campanha agendada com sucesso',
-        'groups_created': len(groups),
-        'total_dispatches': len(groups) * 3,
-        'total_customers': len(customers)
+        'groups_created': groups_count,
+        'total_dispatches': groups_count * 3,
+        'total_customers': total_customers
     })
 
-def _segment_customers():
-    """Segmentar clientes automaticamente"""
-    customers = Customer.query.all()
-    
-    for customer in customers:
-        # Lógica de segmentação
-        if customer.average_ticket >= 100:
-            customer.segment = 'high_ticket'
-        elif customer.order_frequency >= 8:  # 8+ pedidos por mês
-            customer.segment = 'frequent'
-        elif customer.location:
-            customer.segment = 'location_based'
-        else:
-            customer.segment = 'standard'
-
 @campaign_bp.route('/knowledge/books', methods=['GET'])
 def get_marketing_books():
     """Retornar conhecimento sobre livros de marketing"""
@@ -277,7 +325,7 @@ def generate_marketing_content():
             'content_type': 'whatsapp',
             'message_template': segment_template['message'],
             'image_suggestion': segment_template['image_suggestion'],
-            'variables': ['nome_cliente', 'cupom_desconto', 'link_cardapio', 'sabor_preferido']
+            'variables': list(TEMPLATE_VARIABLES)
         })
     else:
         return jsonify(templates.get(content_type, {'message': 'Tipo de conteúdo não encontrado'}))
@@ -1,13 +1,25 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from src.services.crm import CRMAnalytics, CRMRecommendations, campaign_scheduler
 from src.models.campaign import Campaign, Customer, CampaignDispatch, MessageLog
-from src.models.user import db
+from src.models.auth import db
+from src.services.search import apply_customer_search
+from src.services.export import stream_customer_export, validate_export_format, ExportError, EXPORT_FORMATS
+from src.services.pagination import paginate_query, PaginationError
+from src.services.timeseries import count_messages_on, get_message_timeseries
+from src.services.cache import response_cache, CAMPAIGNS_TAG, CUSTOMERS_TAG, DISPATCHES_TAG
 from datetime import datetime, timedelta
 import json
 
 crm_bp = Blueprint('crm', __name__)
 
+# Chaves de ordenação aceitas na paginação por cursor da busca de clientes
+CUSTOMER_SORT_KEYS = {
+    'id': [Customer.id],
+    'name': [Customer.name, Customer.id]
+}
+
 @crm_bp.route('/crm/analytics/campaign/<int:campaign_id>', methods=['GET'])
+@response_cache.cached(tags=(CAMPAIGNS_TAG, DISPATCHES_TAG))
 def get_campaign_analytics(campaign_id):
     """Obter analytics detalhados de uma campanha"""
     try:
@@ -27,6 +39,7 @@ def get_campaign_analytics(campaign_id):
         }), 500
 
 @crm_bp.route('/crm/analytics/customer/<int:customer_id>', methods=['GET'])
+@response_cache.cached(tags=(CUSTOMERS_TAG, DISPATCHES_TAG))
 def get_customer_analytics(customer_id):
     """Obter analytics de engajamento de um cliente"""
     try:
@@ -46,6 +59,7 @@ def get_customer_analytics(customer_id):
         }), 500
 
 @crm_bp.route('/crm/analytics/segments', methods=['GET'])
+@response_cache.cached(tags=(CUSTOMERS_TAG, DISPATCHES_TAG))
 def get_segments_analytics():
     """Obter análise por segmentos de clientes"""
     try:
@@ -62,6 +76,36 @@ def get_segments_analytics():
             'error': str(e)
         }), 500
 
+@crm_bp.route('/crm/analytics/messages/timeseries', methods=['GET'])
+@response_cache.cached(tags=(DISPATCHES_TAG,))
+def get_messages_timeseries():
+    """Obter série temporal de mensagens por hora, dia, semana ou mês"""
+    try:
+        end_day = datetime.fromisoformat(request.args['end']).date() if request.args.get('end') else datetime.utcnow().date()
+        start_day = datetime.fromisoformat(request.args['start']).date() if request.args.get('start') else end_day - timedelta(days=29)
+        bucket = request.args.get('bucket', 'day')
+        
+        series = get_message_timeseries(start_day, end_day, bucket)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except OverflowError:
+        # Datas nos extremos do calendário estouram as contas de intervalo
+        return jsonify({'success': False, 'error': 'Datas fora do intervalo suportado'}), 400
+    
+    try:
+        return jsonify({
+            'success': True,
+            'bucket': bucket,
+            'start': start_day.isoformat(),
+            'end': end_day.isoformat(),
+            'series': series
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @crm_bp.route('/crm/recommendations/campaigns', methods=['GET'])
 def get_campaign_recommendations():
     """Obter recomendações de campanhas"""
@@ -103,6 +147,7 @@ def get_content_recommendations():
         }), 500
 
 @crm_bp.route('/crm/dashboard', methods=['GET'])
+@response_cache.cached(tags=(CAMPAIGNS_TAG, CUSTOMERS_TAG, DISPATCHES_TAG))
 def get_crm_dashboard():
     """Obter dados do dashboard de CRM"""
     try:
@@ -115,10 +160,7 @@ def get_crm_dashboard():
         pending_dispatches = CampaignDispatch.query.filter_by(status='scheduled').count()
         
         # Mensagens enviadas hoje
-        today = datetime.utcnow().date()
-        messages_today = MessageLog.query.filter(
-            db.func.date(MessageLog.sent_date) == today
-        ).count()
+        messages_today = count_messages_on(datetime.utcnow().date())
         
         # Últimas campanhas
         recent_campaigns = Campaign.query.order_by(Campaign.created_at.desc()).limit(5).all()
@@ -160,27 +202,20 @@ def get_crm_dashboard():
 
 @crm_bp.route('/crm/customers/search', methods=['GET'])
 def search_customers():
-    """Buscar clientes por critérios"""
+    """Buscar clientes por critérios
+
+    Com `q` os resultados vêm ordenados por relevância e a paginação é por
+    `page`; a paginação por `cursor` ordena por id ou nome e só vale sem `q`.
+    """
     query = request.args.get('q', '')
     segment = request.args.get('segment')
     min_ticket = request.args.get('min_ticket', type=float)
     max_ticket = request.args.get('max_ticket', type=float)
     min_frequency = request.args.get('min_frequency', type=int)
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 50, type=int)
     
     try:
-        # Construir query
-        customers_query = Customer.query
-        
-        if query:
-            customers_query = customers_query.filter(
-                db.or_(
-                    Customer.name.ilike(f'%{query}%'),
-                    Customer.phone.ilike(f'%{query}%'),
-                    Customer.email.ilike(f'%{query}%')
-                )
-            )
+        # Construir query, com busca textual ordenada por relevância
+        customers_query = apply_customer_search(Customer.query, query)
         
         if segment:
             customers_query = customers_query.filter(Customer.segment == segment)
@@ -194,12 +229,12 @@ def search_customers():
         if min_frequency is not None:
             customers_query = customers_query.filter(Customer.order_frequency >= min_frequency)
         
-        # Paginar resultados
-        customers = customers_query.paginate(
-            page=page, 
-            per_page=per_page, 
-            error_out=False
-        )
+        # O cursor ordena por colunas fixas e descartaria a ordem por relevância
+        if query.strip() and request.args.get('cursor') is not None:
+            raise PaginationError('Paginação por cursor não é suportada com busca textual (q); use page')
+        
+        # Paginar resultados por cursor ou por página
+        customers, pagination = paginate_query(customers_query, request.args, CUSTOMER_SORT_KEYS)
         
         return jsonify({
             'success': True,
@@ -212,16 +247,14 @@ def search_customers():
                 'average_ticket': c.average_ticket,
                 'order_frequency': c.order_frequency,
                 'last_order_date': c.last_order_date.isoformat() if c.last_order_date else None
-            } for c in customers.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': customers.total,
-                'pages': customers.pages,
-                'has_next': customers.has_next,
-                'has_prev': customers.has_prev
-            }
+            } for c in customers],
+            'pagination': pagination
         })
+    except PaginationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -229,24 +262,29 @@ def search_customers():
         }), 500
 
 @crm_bp.route('/crm/campaigns/performance', methods=['GET'])
+@response_cache.cached(tags=(CAMPAIGNS_TAG, DISPATCHES_TAG))
 def get_campaigns_performance():
     """Obter performance de todas as campanhas"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+    
     try:
-        campaigns = Campaign.query.all()
-        performance_data = []
-        
-        for campaign in campaigns:
-            analytics = CRMAnalytics.get_campaign_performance(campaign.id)
-            if analytics:
-                performance_data.append(analytics)
-        
-        # Ordenar por taxa de sucesso
-        performance_data.sort(key=lambda x: x['success_rate'], reverse=True)
+        # Ordenado por taxa de sucesso e paginado no banco
+        performance_data, total_campaigns = CRMAnalytics.get_campaigns_performance(page, per_page)
+        pages = (total_campaigns + per_page - 1) // per_page
         
         return jsonify({
             'success': True,
             'campaigns': performance_data,
-            'total_campaigns': len(performance_data)
+            'total_campaigns': total_campaigns,
+            'pagination': {
+                'page': page,
+                'per_page': per_page,
+                'total': total_campaigns,
+                'pages': pages,
+                'has_next': page < pages,
+                'has_prev': page > 1
+            }
         })
     except Exception as e:
         return jsonify({
@@ -262,7 +300,8 @@ def get_scheduler_status():
             'success': True,
             'scheduler': {
                 'running': campaign_scheduler.running,
-                'thread_alive': campaign_scheduler.thread.is_alive() if campaign_scheduler.thread else False
+                'thread_alive': campaign_scheduler.thread.is_alive() if campaign_scheduler.thread else False,
+                'metrics': campaign_scheduler.get_metrics()
             }
         })
     except Exception as e:
@@ -315,52 +354,33 @@ def stop_scheduler():
 
 @crm_bp.route('/crm/export/customers', methods=['GET'])
 def export_customers():
-    """Exportar dados de clientes em CSV"""
+    """Exportar dados de clientes em CSV, NDJSON ou Parquet, via streaming"""
     segment = request.args.get('segment')
+    export_format = request.args.get('format', 'csv')
     
     try:
-        import io
-        import csv
-        
-        # Buscar clientes
-        query = Customer.query
-        if segment:
-            query = query.filter(Customer.segment == segment)
-        
-        customers = query.all()
-        
-        # Criar CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Cabeçalho
-        writer.writerow([
-            'ID', 'Nome', 'Telefone', 'Email', 'Localização', 
-            'Ticket Médio', 'Frequência', 'Segmento', 'Último Pedido'
-        ])
-        
-        # Dados
-        for customer in customers:
-            writer.writerow([
-                customer.id,
-                customer.name,
-                customer.phone,
-                customer.email or '',
-                customer.location or '',
-                customer.average_ticket or 0,
-                customer.order_frequency or 0,
-                customer.segment or '',
-                customer.last_order_date.strftime('%Y-%m-%d') if customer.last_order_date else ''
-            ])
+        validate_export_format(export_format)
+    except ExportError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    try:
+        mimetype, extension = EXPORT_FORMATS[export_format]
+        compress = export_format != 'parquet' and 'gzip' in request.accept_encodings
         
-        output.seek(0)
+        response = Response(
+            stream_with_context(stream_customer_export(export_format, segment, compress)),
+            mimetype=mimetype
+        )
+        filename = f"clientes_{segment or 'todos'}_{datetime.utcnow().strftime('%Y%m%d')}.{extension}"
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.headers['Vary'] = 'Accept-Encoding'
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
         
-        return jsonify({
-            'success': True,
-            'csv_data': output.getvalue(),
-            'total_customers': len(customers),
-            'segment': segment or 'all'
-        })
+        return response
     except Exception as e:
         return jsonify({
             'success': False,
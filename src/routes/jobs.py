@@ -0,0 +1,64 @@
+from flask import Blueprint, request, jsonify
+from src.models.job import BackgroundJob
+from src.services.jobs import job_queue, FINISHED_STATUSES
+
+jobs_bp = Blueprint('jobs', __name__)
+
+@jobs_bp.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Listar tarefas em segundo plano mais recentes"""
+    status = request.args.get('status')
+    job_type = request.args.get('type')
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    
+    query = BackgroundJob.query
+    if status:
+        query = query.filter(BackgroundJob.status == status)
+    if job_type:
+        query = query.filter(BackgroundJob.job_type == job_type)
+    
+    jobs = query.order_by(BackgroundJob.created_at.desc()).limit(limit).all()
+    
+    return jsonify({
+        'success': True,
+        'jobs': [job.to_dict() for job in jobs]
+    })
+
+@jobs_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Obter status, progresso e resultado de uma tarefa"""
+    job = BackgroundJob.query.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Tarefa não encontrada'}), 404
+    
+    return jsonify({
+        'success': True,
+        'job': job.to_dict()
+    })
+
+@jobs_bp.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancelar uma tarefa na fila ou em execução"""
+    job = BackgroundJob.query.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Tarefa não encontrada'}), 404
+    
+    if job.status in FINISHED_STATUSES:
+        return jsonify({
+            'success': False,
+            'error': f'Tarefa já finalizada ({job.status})'
+        }), 409
+    
+    try:
+        job_queue.cancel(job_id)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Cancelamento solicitado',
+            'job_id': job_id
+        }), 202
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
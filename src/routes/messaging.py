@@ -1,8 +1,15 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, url_for, current_app
 from src.services.messaging import WhatsAppService, CampaignExecutor, SocialMediaService
+from src.services.rate_limiter import get_rate_limiter, get_all_metrics
+from src.services.jobs import job_queue
+from src.services.dispatch_orchestrator import get_dispatch_orchestrator
+from src.services.dispatch_leases import recover_expired_leases
+from src.services.pagination import paginate_query, PaginationError
+from src.services.cache import response_cache, CAMPAIGNS_TAG, DISPATCHES_TAG
 from src.models.campaign import CampaignDispatch, MessageLog
-from src.models.user import db
+from src.models.auth import db
 from datetime import datetime
+from concurrent.futures import as_completed
 import os
 
 messaging_bp = Blueprint('messaging', __name__)
@@ -12,15 +19,100 @@ EVOLUTION_API_URL = os.getenv('EVOLUTION_API_URL', 'http://localhost:8080')
 EVOLUTION_API_KEY = os.getenv('EVOLUTION_API_KEY', 'your-api-key')
 EVOLUTION_INSTANCE = os.getenv('EVOLUTION_INSTANCE', 'your-instance')
 
+# Quantidade de mensagens recentes no relatório de campanha
+RECENT_MESSAGES_LIMIT = 10
+
+# Chaves de ordenação da paginação do relatório de campanha
+DISPATCH_SORT_KEYS = {
+    'id': [CampaignDispatch.id],
+    'scheduled_date': [CampaignDispatch.scheduled_date, CampaignDispatch.id]
+}
+MESSAGE_SORT_KEYS = {
+    'id': [MessageLog.id]
+}
+
+def _serialize_message_log(log):
+    return {
+        'id': log.id,
+        'dispatch_id': log.dispatch_id,
+        'phone': log.phone_number,
+        'status': log.status,
+        'sent_date': log.sent_date.isoformat() if log.sent_date else None,
+        'error': log.error_message
+    }
+
+def _create_whatsapp_service():
+    """Criar o serviço de WhatsApp com a configuração da Evolution API"""
+    return WhatsAppService(
+        EVOLUTION_API_URL, 
+        EVOLUTION_API_KEY, 
+        EVOLUTION_INSTANCE
+    )
+
+def _get_pending_dispatches():
+    """Pares (id do disparo, id da campanha) dos disparos cujo horário já chegou"""
+    recover_expired_leases()
+    now = datetime.utcnow()
+    
+    rows = db.session.query(CampaignDispatch.id, CampaignDispatch.campaign_id).filter(
+        CampaignDispatch.status == 'scheduled',
+        CampaignDispatch.scheduled_date <= now
+    ).order_by(CampaignDispatch.scheduled_date, CampaignDispatch.id)
+    
+    return [(row.id, row.campaign_id) for row in rows]
+
+def _run_dispatch_job(context):
+    """Tarefa em segundo plano de execução de um disparo"""
+    executor = CampaignExecutor(_create_whatsapp_service())
+    
+    def on_progress(stats):
+        context.update_progress(stats)
+        context.check_cancelled()
+    
+    # Execução manual também retoma disparos que falharam no meio; se for
+    # cancelada, o disparo fica 'failed' para não ser retomado pelo agendador
+    return executor.execute_dispatch(
+        context.payload['dispatch_id'],
+        resume_failed=True,
+        failure_status='failed',
+        progress_callback=on_progress
+    )
+
+def _run_pending_dispatches_job(context):
+    """Tarefa em segundo plano de execução dos disparos pendentes, em paralelo"""
+    dispatches = _get_pending_dispatches()
+    # Mesmo orquestrador do agendador: os limites de paralelismo valem para o processo
+    orchestrator = get_dispatch_orchestrator(current_app._get_current_object(), _create_whatsapp_service())
+    futures = [orchestrator.submit(dispatch_id, campaign_id) for dispatch_id, campaign_id in dispatches]
+    results = []
+    
+    try:
+        for future in as_completed(futures):
+            results.append(future.result())
+            context.update_progress({
+                'processed': len(results),
+                'total': len(dispatches)
+            })
+            context.check_cancelled()
+    finally:
+        # Em caso de cancelamento, os disparos que não começaram são descartados
+        for future in futures:
+            future.cancel()
+    
+    return {
+        'message': f'{len(results)} disparos processados',
+        'executed': len(results),
+        'results': results
+    }
+
+job_queue.register('execute_dispatch', _run_dispatch_job)
+job_queue.register('execute_pending_dispatches', _run_pending_dispatches_job)
+
 @messaging_bp.route('/whatsapp/test-connection', methods=['GET'])
 def test_whatsapp_connection():
     """Testar conexão com Evolution API"""
     try:
-        whatsapp_service = WhatsAppService(
-            EVOLUTION_API_URL, 
-            EVOLUTION_API_KEY, 
-            EVOLUTION_INSTANCE
-        )
+        whatsapp_service = _create_whatsapp_service()
         
         status = whatsapp_service.get_instance_status()
         return jsonify({
@@ -33,6 +125,17 @@ def test_whatsapp_connection():
             'message': str(e)
         }), 500
 
+@messaging_bp.route('/whatsapp/rate-limit', methods=['GET'])
+def get_whatsapp_rate_limit():
+    """Métricas do limitador de taxa de envio"""
+    # Garantir que a instância configurada apareça mesmo antes do primeiro envio
+    get_rate_limiter(EVOLUTION_INSTANCE)
+    
+    return jsonify({
+        'status': 'success',
+        'instances': get_all_metrics()
+    })
+
 @messaging_bp.route('/whatsapp/send-test', methods=['POST'])
 def send_test_message():
     """Enviar mensagem de teste"""
@@ -44,11 +147,7 @@ def send_test_message():
         return jsonify({'error': 'Número de telefone é obrigatório'}), 400
     
     try:
-        whatsapp_service = WhatsAppService(
-            EVOLUTION_API_URL, 
-            EVOLUTION_API_KEY, 
-            EVOLUTION_INSTANCE
-        )
+        whatsapp_service = _create_whatsapp_service()
         
         result = whatsapp_service.send_text_message(phone, message)
         
@@ -65,21 +164,22 @@ def send_test_message():
 
 @messaging_bp.route('/dispatches/execute/<int:dispatch_id>', methods=['POST'])
 def execute_dispatch(dispatch_id):
-    """Executar um disparo específico"""
+    """Executar um disparo específico em segundo plano"""
+    dispatch = CampaignDispatch.query.get(dispatch_id)
+    if not dispatch:
+        return jsonify({
+            'status': 'error',
+            'message': f'Disparo {dispatch_id} não encontrado'
+        }), 404
+    
     try:
-        whatsapp_service = WhatsAppService(
-            EVOLUTION_API_URL, 
-            EVOLUTION_API_KEY, 
-            EVOLUTION_INSTANCE
-        )
-        
-        executor = CampaignExecutor(whatsapp_service)
-        result = executor.execute_dispatch(dispatch_id)
+        job_id = job_queue.enqueue('execute_dispatch', {'dispatch_id': dispatch_id})
         
         return jsonify({
-            'status': 'success',
-            'result': result
-        })
+            'status': 'queued',
+            'job_id': job_id,
+            'status_url': url_for('jobs.get_job', job_id=job_id)
+        }), 202
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -108,15 +208,10 @@ def get_pending_dispatches():
 
 @messaging_bp.route('/dispatches/execute-pending', methods=['POST'])
 def execute_pending_dispatches():
-    """Executar todos os disparos pendentes"""
-    now = datetime.utcnow()
+    """Executar todos os disparos pendentes em segundo plano"""
+    pending_count = len(_get_pending_dispatches())
     
-    pending_dispatches = CampaignDispatch.query.filter(
-        CampaignDispatch.status == 'scheduled',
-        CampaignDispatch.scheduled_date <= now
-    ).all()
-    
-    if not pending_dispatches:
+    if not pending_count:
         return jsonify({
             'status': 'success',
             'message': 'Nenhum disparo pendente encontrado',
@@ -124,30 +219,14 @@ def execute_pending_dispatches():
         })
     
     try:
-        whatsapp_service = WhatsAppService(
-            EVOLUTION_API_URL, 
-            EVOLUTION_API_KEY, 
-            EVOLUTION_INSTANCE
-        )
-        
-        executor = CampaignExecutor(whatsapp_service)
-        results = []
-        
-        for dispatch in pending_dispatches:
-            try:
-                result = executor.execute_dispatch(dispatch.id)
-                results.append(result)
-            except Exception as e:
-                results.append({
-                    'dispatch_id': dispatch.id,
-                    'error': str(e)
-                })
+        job_id = job_queue.enqueue('execute_pending_dispatches')
         
         return jsonify({
-            'status': 'success',
-            'message': f'{len(results)} disparos processados',
-            'results': results
-        })
+            'status': 'queued',
+            'message': f'{pending_count} disparos pendentes enviados para execução',
+            'job_id': job_id,
+            'status_url': url_for('jobs.get_job', job_id=job_id)
+        }), 202
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -189,39 +268,93 @@ def post_to_social_media():
         }), 500
 
 @messaging_bp.route('/reports/campaign/<int:campaign_id>', methods=['GET'])
+@response_cache.cached(tags=(CAMPAIGNS_TAG, DISPATCHES_TAG))
 def get_campaign_report(campaign_id):
     """Relatório de uma campanha específica"""
-    dispatches = CampaignDispatch.query.filter_by(campaign_id=campaign_id).all()
-    
-    total_sent = sum(d.success_count or 0 for d in dispatches)
-    total_failed = sum(d.failed_count or 0 for d in dispatches)
-    total_scheduled = sum(d.customers_count for d in dispatches if d.status == 'scheduled')
-    
-    # Logs de mensagens para análise detalhada
-    message_logs = MessageLog.query.filter_by(campaign_id=campaign_id).all()
-    
-    return jsonify({
-        'campaign_id': campaign_id,
-        'total_dispatches': len(dispatches),
-        'total_sent': total_sent,
-        'total_failed': total_failed,
-        'total_scheduled': total_scheduled,
-        'success_rate': (total_sent / (total_sent + total_failed)) * 100 if (total_sent + total_failed) > 0 else 0,
-        'dispatches': [{
-            'id': d.id,
-            'group': d.customer_group,
-            'dispatch_number': d.dispatch_number,
-            'status': d.status,
-            'scheduled_date': d.scheduled_date.isoformat(),
-            'sent_date': d.sent_date.isoformat() if d.sent_date else None,
-            'success_count': d.success_count,
-            'failed_count': d.failed_count
-        } for d in dispatches],
-        'recent_messages': [{
-            'phone': log.phone_number,
-            'status': log.status,
-            'sent_date': log.sent_date.isoformat() if log.sent_date else None,
-            'error': log.error_message
-        } for log in message_logs[-10:]]  # Últimas 10 mensagens
-    })
+    try:
+        # Totais calculados no banco, sem carregar disparos ou logs
+        totals = db.session.query(
+            db.func.count(CampaignDispatch.id),
+            db.func.coalesce(db.func.sum(CampaignDispatch.success_count), 0),
+            db.func.coalesce(db.func.sum(CampaignDispatch.failed_count), 0),
+            db.func.coalesce(db.func.sum(db.case(
+                (CampaignDispatch.status == 'scheduled', CampaignDispatch.customers_count),
+                else_=0
+            )), 0)
+        ).filter(CampaignDispatch.campaign_id == campaign_id).one()
+        total_dispatches, total_sent, total_failed, total_scheduled = totals
+        
+        dispatches, pagination = paginate_query(
+            CampaignDispatch.query.filter_by(campaign_id=campaign_id).order_by(CampaignDispatch.id),
+            request.args,
+            DISPATCH_SORT_KEYS
+        )
+        
+        # Últimas mensagens, incluindo falhas, lidas pelo índice (campaign_id, created_at)
+        recent_messages = MessageLog.query.filter(
+            MessageLog.campaign_id == campaign_id
+        ).order_by(
+            MessageLog.created_at.desc(),
+            MessageLog.id.desc()
+        ).limit(RECENT_MESSAGES_LIMIT).all()
+        
+        return jsonify({
+            'campaign_id': campaign_id,
+            'total_dispatches': total_dispatches,
+            'total_sent': total_sent,
+            'total_failed': total_failed,
+            'total_scheduled': total_scheduled,
+            'success_rate': (total_sent / (total_sent + total_failed)) * 100 if (total_sent + total_failed) > 0 else 0,
+            'dispatches': [{
+                'id': d.id,
+                'group': d.customer_group,
+                'dispatch_number': d.dispatch_number,
+                'status': d.status,
+                'scheduled_date': d.scheduled_date.isoformat(),
+                'sent_date': d.sent_date.isoformat() if d.sent_date else None,
+                'success_count': d.success_count,
+                'failed_count': d.failed_count
+            } for d in dispatches],
+            'dispatches_pagination': pagination,
+            'recent_messages': [_serialize_message_log(log) for log in recent_messages],
+            'messages_url': url_for('messaging.get_campaign_messages', campaign_id=campaign_id)
+        })
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@messaging_bp.route('/reports/campaign/<int:campaign_id>/messages', methods=['GET'])
+def get_campaign_messages(campaign_id):
+    """Logs de mensagens de uma campanha, paginados por cursor"""
+    try:
+        query = MessageLog.query.filter(MessageLog.campaign_id == campaign_id)
+        
+        status = request.args.get('status')
+        if status:
+            query = query.filter(MessageLog.status == status)
+        
+        dispatch_id = request.args.get('dispatch_id', type=int)
+        if dispatch_id:
+            query = query.filter(MessageLog.dispatch_id == dispatch_id)
+        
+        # Mais recentes primeiro; o total só é contado se pedido
+        messages, pagination = paginate_query(
+            query,
+            request.args,
+            MESSAGE_SORT_KEYS,
+            default_order='desc',
+            default_count='none',
+            cursor_only=True
+        )
+        
+        return jsonify({
+            'campaign_id': campaign_id,
+            'messages': [_serialize_message_log(log) for log in messages],
+            'pagination': pagination
+        })
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response, Response
+from flask_login import current_user
+
+logger = logging.getLogger(__name__)
+
+# Configurações do cache de respostas
+CACHE_DEFAULT_TTL = int(os.getenv('CACHE_DEFAULT_TTL', '30'))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '1024'))
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')
+
+class MemoryCacheBackend:
+    """Cache em memória do processo com expiração por TTL e descarte LRU"""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or CACHE_MAX_ENTRIES
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+class RedisCacheBackend:
+    """Cache compartilhado entre processos via Redis (dependência opcional)"""
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(key, json.dumps(value), ex=ttl)
+
+    def get_counter(self, key):
+        return int(self.client.get(key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+class ResponseCache:
+    """Cache de respostas JSON de leitura, com invalidação por tags e ETag
+
+    Cada tag tem um contador de versão que entra na chave do cache; invalidar
+    uma tag incrementa o contador e torna obsoletas todas as respostas que
+    dependem dela. Com o backend em memória a invalidação vale só para o
+    processo atual e os demais dependem do TTL; com Redis ela é global.
+    """
+
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = self._create_backend()
+        return self._backend
+
+    @staticmethod
+    def _create_backend():
+        if CACHE_REDIS_URL:
+            try:
+                return RedisCacheBackend(CACHE_REDIS_URL)
+            except ImportError:
+                logger.error("CACHE_REDIS_URL definido, mas o pacote redis não está instalado; usando cache em memória")
+        return MemoryCacheBackend()
+
+    def invalidate(self, *tags):
+        """Invalidar as respostas que dependem das tags informadas"""
+        for tag in tags:
+            try:
+                self.backend.incr(f'tag:{tag}')
+            except Exception as e:
+                logger.error(f"Erro ao invalidar cache ({tag}): {str(e)}")
+
+    def _build_key(self, tags):
+        user_id = current_user.get_id() if current_user.is_authenticated else 'anon'
+        args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+        versions = ','.join(f'{tag}:{self.backend.get_counter(f"tag:{tag}")}' for tag in tags)
+        return f'resp:{request.path}?{args}|user:{user_id}|{versions}'
+
+    @staticmethod
+    def _conditional_response(entry):
+        """Montar a resposta, ou 304 se o cliente já tem a mesma versão"""
+        if request.if_none_match.contains(entry['etag']):
+            response = Response(status=304)
+        else:
+            response = Response(entry['body'], status=200, mimetype=entry['mimetype'])
+
+        response.set_etag(entry['etag'])
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def cached(self, tags=(), ttl=None):
+        """Decorator de rotas GET: guarda respostas 200 por rota, argumentos e usuário"""
+        ttl = ttl or CACHE_DEFAULT_TTL
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                try:
+                    key = self._build_key(tags)
+                    entry = self.backend.get(key)
+                except Exception as e:
+                    logger.error(f"Erro ao ler cache: {str(e)}")
+                    return view(*args, **kwargs)
+
+                if entry is not None:
+                    return self._conditional_response(entry)
+
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+
+                body = response.get_data(as_text=True)
+                entry = {
+                    'body': body,
+                    'mimetype': response.mimetype,
+                    'etag': hashlib.sha1(body.encode('utf-8')).hexdigest()
+                }
+
+                try:
+                    self.backend.set(key, entry, ttl)
+                except Exception as e:
+                    logger.error(f"Erro ao gravar cache: {str(e)}")
+
+                return self._conditional_response(entry)
+
+            return wrapper
+        return decorator
+
+# Instância global do cache de respostas
+response_cache = ResponseCache()
+
+# Tags de invalidação usadas pelas rotas de leitura
+CAMPAIGNS_TAG = 'campaigns'
+CUSTOMERS_TAG = 'customers'
+DISPATCHES_TAG = 'dispatches'
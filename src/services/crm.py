@@ -1,10 +1,12 @@
-import schedule
+import heapq
 import time
 import threading
 from datetime import datetime, timedelta
 from src.models.campaign import CampaignDispatch
-from src.models.user import db
-from src.services.messaging import WhatsAppService, CampaignExecutor
+from src.models.auth import db
+from src.services.messaging import WhatsAppService
+from src.services.dispatch_orchestrator import get_dispatch_orchestrator, shutdown_dispatch_orchestrator
+from src.services.dispatch_leases import recover_expired_leases
 import os
 import logging
 
@@ -12,8 +14,17 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Intervalo de ressincronização com o banco, para disparos criados em outros processos
+SCHEDULER_RESYNC_SECONDS = float(os.getenv('SCHEDULER_RESYNC_SECONDS', '300'))
+
 class CampaignScheduler:
-    """Agendador de campanhas para execução automática"""
+    """Agendador de campanhas para execução automática
+
+    Mantém um heap com as datas dos disparos agendados e dorme até o
+    próximo vencimento; novos agendamentos acordam a thread na hora.
+    Uma ressincronização periódica com o banco cobre disparos criados
+    ou alterados por outros processos.
+    """
     
     def __init__(self):
         self.running = False
@@ -24,8 +35,19 @@ class CampaignScheduler:
         self.evolution_api_key = os.getenv('EVOLUTION_API_KEY', 'your-api-key')
         self.evolution_instance = os.getenv('EVOLUTION_INSTANCE', 'your-instance')
         
-        # Configurar agendamento para verificar disparos pendentes a cada 5 minutos
-        schedule.every(5).minutes.do(self.check_pending_dispatches)
+        # Heap de (data agendada, id do disparo); entradas antigas são descartadas
+        # ao sair do heap se a data não bate mais com self._scheduled
+        self._heap = []
+        self._scheduled = {}
+        self._condition = threading.Condition()
+        self._last_resync = None
+        self.orchestrator = None
+        
+        # Métricas de atraso entre a data agendada e o início do disparo
+        self.dispatches_started = 0
+        self.last_lag_seconds = None
+        self.max_lag_seconds = 0.0
+        self.total_lag_seconds = 0.0
         
         logger.info("CampaignScheduler inicializado")
     
@@ -39,64 +61,162 @@ class CampaignScheduler:
     
     def stop(self):
         """Parar o agendador"""
-        self.running = False
+        with self._condition:
+            self.running = False
+            self._condition.notify_all()
         if self.thread:
             self.thread.join()
+        if self.orchestrator:
+            shutdown_dispatch_orchestrator(wait=True)
+            self.orchestrator = None
         logger.info("CampaignScheduler parado")
     
+    def notify_scheduled(self, dispatches):
+        """Registrar disparos criados ou reagendados, acordando o agendador
+
+        Recebe pares (id do disparo, data agendada).
+        """
+        with self._condition:
+            if not self.running:
+                return
+            for dispatch_id, scheduled_date in dispatches:
+                self._push(dispatch_id, scheduled_date)
+            self._condition.notify_all()
+    
+    def _push(self, dispatch_id, scheduled_date):
+        if self._scheduled.get(dispatch_id) == scheduled_date:
+            return
+        self._scheduled[dispatch_id] = scheduled_date
+        heapq.heappush(self._heap, (scheduled_date, dispatch_id))
+    
+    def _next_entry(self):
+        """Primeira entrada válida do heap, descartando as obsoletas"""
+        while self._heap:
+            scheduled_date, dispatch_id = self._heap[0]
+            if self._scheduled.get(dispatch_id) == scheduled_date:
+                return scheduled_date, dispatch_id
+            heapq.heappop(self._heap)
+        return None
+    
+    def _pop_due(self, now):
+        due = []
+        entry = self._next_entry()
+        while entry and entry[0] <= now:
+            heapq.heappop(self._heap)
+            del self._scheduled[entry[1]]
+            due.append(entry)
+            entry = self._next_entry()
+        return due
+    
+    def _resync(self):
+        """Recarregar do banco os disparos ainda agendados"""
+        from src.main import app
+        
+        with app.app_context():
+            # Disparos de workers que pararam de renovar o lease voltam à fila
+            recover_expired_leases()
+            rows = db.session.query(
+                CampaignDispatch.id,
+                CampaignDispatch.scheduled_date
+            ).filter(CampaignDispatch.status == 'scheduled').all()
+        
+        with self._condition:
+            self._heap = []
+            self._scheduled = {}
+            for dispatch_id, scheduled_date in rows:
+                self._push(dispatch_id, scheduled_date)
+            self._last_resync = time.monotonic()
+        
+        logger.info(f"Agendador sincronizado: {len(rows)} disparos agendados")
+    
     def _run_scheduler(self):
-        """Executar o loop do agendador"""
+        """Executar o loop do agendador, dormindo até o próximo disparo"""
         while self.running:
             try:
-                schedule.run_pending()
-                time.sleep(60)  # Verificar a cada minuto
+                if self._last_resync is None or time.monotonic() - self._last_resync >= SCHEDULER_RESYNC_SECONDS:
+                    self._resync()
+                
+                with self._condition:
+                    if not self.running:
+                        break
+                    
+                    due = self._pop_due(datetime.utcnow())
+                    if not due:
+                        timeout = SCHEDULER_RESYNC_SECONDS - (time.monotonic() - self._last_resync)
+                        entry = self._next_entry()
+                        if entry:
+                            timeout = min(timeout, (entry[0] - datetime.utcnow()).total_seconds())
+                        self._condition.wait(max(timeout, 0))
+                        continue
+                
+                self._execute_due(due)
             except Exception as e:
                 logger.error(f"Erro no agendador: {str(e)}")
-                time.sleep(60)
+                with self._condition:
+                    self._condition.wait(60)
     
-    def check_pending_dispatches(self):
-        """Verificar e executar disparos pendentes"""
-        try:
+    def _record_lag(self, scheduled_date):
+        lag = max(0.0, (datetime.utcnow() - scheduled_date).total_seconds())
+        with self._condition:
+            self.dispatches_started += 1
+            self.last_lag_seconds = lag
+            self.max_lag_seconds = max(self.max_lag_seconds, lag)
+            self.total_lag_seconds += lag
+    
+    def _get_orchestrator(self):
+        """Orquestrador do processo, o mesmo das execuções manuais"""
+        if self.orchestrator is None:
             from src.main import app
             
-            with app.app_context():
-                now = datetime.utcnow()
-                
-                # Buscar disparos que devem ser executados agora
-                pending_dispatches = CampaignDispatch.query.filter(
-                    CampaignDispatch.status == 'scheduled',
-                    CampaignDispatch.scheduled_date <= now
-                ).all()
-                
-                if not pending_dispatches:
-                    logger.info("Nenhum disparo pendente encontrado")
-                    return
+            whatsapp_service = WhatsAppService(
+                self.evolution_api_url,
+                self.evolution_api_key,
+                self.evolution_instance
+            )
+            self.orchestrator = get_dispatch_orchestrator(app, whatsapp_service)
+        return self.orchestrator
+    
+    def _execute_due(self, due):
+        """Entregar os disparos vencidos ao orquestrador, sem esperar a execução"""
+        from src.main import app
+        
+        orchestrator = self._get_orchestrator()
+        
+        with app.app_context():
+            for scheduled_date, dispatch_id in due:
+                dispatch = CampaignDispatch.query.get(dispatch_id)
                 
-                logger.info(f"Encontrados {len(pending_dispatches)} disparos pendentes")
+                # Disparos já executados manualmente ou alterados ficam de fora
+                if not dispatch or dispatch.status != 'scheduled':
+                    continue
+                if dispatch.scheduled_date > datetime.utcnow():
+                    self.notify_scheduled([(dispatch.id, dispatch.scheduled_date)])
+                    continue
                 
-                # Configurar serviços
-                whatsapp_service = WhatsAppService(
-                    self.evolution_api_url,
-                    self.evolution_api_key,
-                    self.evolution_instance
+                logger.info(f"Enfileirando disparo {dispatch.id} da campanha {dispatch.campaign_id}")
+                orchestrator.submit(
+                    dispatch.id,
+                    dispatch.campaign_id,
+                    on_start=lambda scheduled_date=scheduled_date: self._record_lag(scheduled_date),
+                    mark_failed=True
                 )
-                
-                executor = CampaignExecutor(whatsapp_service)
-                
-                # Executar cada disparo
-                for dispatch in pending_dispatches:
-                    try:
-                        logger.info(f"Executando disparo {dispatch.id} da campanha {dispatch.campaign.name}")
-                        result = executor.execute_dispatch(dispatch.id)
-                        logger.info(f"Disparo {dispatch.id} executado: {result['success_count']} sucessos, {result['failed_count']} falhas")
-                    except Exception as e:
-                        logger.error(f"Erro ao executar disparo {dispatch.id}: {str(e)}")
-                        # Marcar disparo como falhou
-                        dispatch.status = 'failed'
-                        db.session.commit()
-                
-        except Exception as e:
-            logger.error(f"Erro ao verificar disparos pendentes: {str(e)}")
+    
+    def get_metrics(self):
+        """Métricas do agendador e do atraso dos disparos"""
+        with self._condition:
+            entry = self._next_entry()
+            now = datetime.utcnow()
+            return {
+                'queued_dispatches': len(self._scheduled),
+                'next_dispatch_at': entry[0].isoformat() if entry else None,
+                'next_dispatch_in_seconds': round((entry[0] - now).total_seconds(), 3) if entry else None,
+                'dispatches_started': self.dispatches_started,
+                'last_lag_seconds': round(self.last_lag_seconds, 3) if self.last_lag_seconds is not None else None,
+                'max_lag_seconds': round(self.max_lag_seconds, 3),
+                'avg_lag_seconds': round(self.total_lag_seconds / self.dispatches_started, 3) if self.dispatches_started else None,
+                'seconds_since_resync': round(time.monotonic() - self._last_resync, 3) if self._last_resync is not None else None,
+                'orchestrator': self.orchestrator.get_metrics() if self.orchestrator else None
+            }
 
 class CRMAnalytics:
     """Classe para análises e relatórios de CRM"""
@@ -104,55 +224,153 @@ class CRMAnalytics:
     @staticmethod
     def get_campaign_performance(campaign_id):
         """Obter performance de uma campanha"""
-        from src.models.campaign import Campaign, CampaignDispatch, MessageLog
+        from src.models.campaign import Campaign
         
         campaign = Campaign.query.get(campaign_id)
         if not campaign:
             return None
         
-        dispatches = CampaignDispatch.query.filter_by(campaign_id=campaign_id).all()
-        message_logs = MessageLog.query.filter_by(campaign_id=campaign_id).all()
+        dispatch_rows = CRMAnalytics._get_dispatch_aggregates([campaign_id])
+        logs_counts = CRMAnalytics._get_message_log_counts([campaign_id])
+        
+        return CRMAnalytics._build_campaign_performance(
+            campaign,
+            dispatch_rows.get(campaign_id, []),
+            logs_counts.get(campaign_id, 0)
+        )
+    
+    @staticmethod
+    def get_campaigns_performance(page=1, per_page=50):
+        """Performance de todas as campanhas, ordenada por taxa de sucesso
+
+        Usa um número fixo de consultas agrupadas, independente da quantidade
+        de campanhas; a ordenação e a paginação são feitas no banco.
+        """
+        from src.models.campaign import Campaign, CampaignDispatch
+        
+        totals = db.session.query(
+            CampaignDispatch.campaign_id,
+            db.func.sum(CampaignDispatch.success_count).label('sent'),
+            db.func.sum(CampaignDispatch.failed_count).label('failed')
+        ).group_by(CampaignDispatch.campaign_id).subquery()
+        
+        sent = db.func.coalesce(totals.c.sent, 0)
+        failed = db.func.coalesce(totals.c.failed, 0)
+        success_rate = db.case(
+            (sent + failed > 0, sent * 100.0 / (sent + failed)),
+            else_=0
+        )
+        
+        total_campaigns = Campaign.query.count()
+        campaigns = Campaign.query.outerjoin(
+            totals, totals.c.campaign_id == Campaign.id
+        ).order_by(
+            success_rate.desc(),
+            Campaign.id
+        ).offset((page - 1) * per_page).limit(per_page).all()
+        
+        campaign_ids = [c.id for c in campaigns]
+        dispatch_rows = CRMAnalytics._get_dispatch_aggregates(campaign_ids)
+        logs_counts = CRMAnalytics._get_message_log_counts(campaign_ids)
+        
+        performance_data = [
+            CRMAnalytics._build_campaign_performance(
+                campaign,
+                dispatch_rows.get(campaign.id, []),
+                logs_counts.get(campaign.id, 0)
+            )
+            for campaign in campaigns
+        ]
+        
+        return performance_data, total_campaigns
+    
+    @staticmethod
+    def _get_dispatch_aggregates(campaign_ids):
+        """Totais dos disparos agrupados por campanha, número do disparo e status"""
+        from src.models.campaign import CampaignDispatch
+        
+        rows = db.session.query(
+            CampaignDispatch.campaign_id,
+            CampaignDispatch.dispatch_number,
+            CampaignDispatch.status,
+            db.func.count(CampaignDispatch.id).label('groups'),
+            db.func.coalesce(db.func.sum(CampaignDispatch.success_count), 0).label('sent'),
+            db.func.coalesce(db.func.sum(CampaignDispatch.failed_count), 0).label('failed'),
+            db.func.coalesce(db.func.sum(CampaignDispatch.customers_count), 0).label('customers')
+        ).filter(
+            CampaignDispatch.campaign_id.in_(campaign_ids)
+        ).group_by(
+            CampaignDispatch.campaign_id,
+            CampaignDispatch.dispatch_number,
+            CampaignDispatch.status
+        ).all()
+        
+        aggregates = {}
+        for row in rows:
+            aggregates.setdefault(row.campaign_id, []).append(row)
+        return aggregates
+    
+    @staticmethod
+    def _get_message_log_counts(campaign_ids):
+        """Quantidade de logs de mensagens por campanha, lida dos rollups"""
+        from src.models.campaign import CampaignMessageRollup
         
-        total_sent = sum(d.success_count or 0 for d in dispatches)
-        total_failed = sum(d.failed_count or 0 for d in dispatches)
-        total_scheduled = sum(d.customers_count for d in dispatches if d.status == 'scheduled')
+        rows = db.session.query(
+            CampaignMessageRollup.campaign_id,
+            db.func.sum(CampaignMessageRollup.message_count)
+        ).filter(
+            CampaignMessageRollup.campaign_id.in_(campaign_ids)
+        ).group_by(CampaignMessageRollup.campaign_id).all()
+        
+        return {campaign_id: int(count or 0) for campaign_id, count in rows}
+    
+    @staticmethod
+    def _build_campaign_performance(campaign, dispatch_rows, message_logs_count):
+        """Montar a performance de uma campanha a partir dos totais agregados"""
+        total_sent = sum(r.sent for r in dispatch_rows)
+        total_failed = sum(r.failed for r in dispatch_rows)
+        total_scheduled = sum(r.customers for r in dispatch_rows if r.status == 'scheduled')
         
         # Calcular métricas por disparo (1º, 2º, 3º)
         dispatch_metrics = {}
         for dispatch_num in [1, 2, 3]:
-            dispatch_data = [d for d in dispatches if d.dispatch_number == dispatch_num]
+            dispatch_data = [r for r in dispatch_rows if r.dispatch_number == dispatch_num]
             dispatch_metrics[f'dispatch_{dispatch_num}'] = {
-                'total_groups': len(dispatch_data),
-                'sent': sum(d.success_count or 0 for d in dispatch_data),
-                'failed': sum(d.failed_count or 0 for d in dispatch_data),
-                'pending': len([d for d in dispatch_data if d.status == 'scheduled'])
+                'total_groups': sum(r.groups for r in dispatch_data),
+                'sent': sum(r.sent for r in dispatch_data),
+                'failed': sum(r.failed for r in dispatch_data),
+                'pending': sum(r.groups for r in dispatch_data if r.status == 'scheduled')
             }
         
         return {
-            'campaign_id': campaign_id,
+            'campaign_id': campaign.id,
             'campaign_name': campaign.name,
             'target_segment': campaign.target_segment,
             'status': campaign.status,
             'created_at': campaign.created_at.isoformat(),
-            'total_dispatches': len(dispatches),
+            'total_dispatches': sum(r.groups for r in dispatch_rows),
             'total_sent': total_sent,
             'total_failed': total_failed,
             'total_scheduled': total_scheduled,
             'success_rate': (total_sent / (total_sent + total_failed)) * 100 if (total_sent + total_failed) > 0 else 0,
             'dispatch_metrics': dispatch_metrics,
-            'message_logs_count': len(message_logs)
+            'message_logs_count': message_logs_count
         }
     
     @staticmethod
     def get_customer_engagement(customer_id):
         """Obter engajamento de um cliente específico"""
-        from src.models.campaign import Customer, MessageLog
+        from src.models.campaign import Customer, MessageLog, MESSAGE_RESULT_STATUSES
         
         customer = Customer.query.get(customer_id)
         if not customer:
             return None
         
-        message_logs = MessageLog.query.filter_by(customer_id=customer_id).all()
+        # Reservas 'pending' ainda não são mensagens recebidas
+        message_logs = MessageLog.query.filter(
+            MessageLog.customer_id == customer_id,
+            MessageLog.status.in_(MESSAGE_RESULT_STATUSES)
+        ).all()
         
         # Calcular métricas de engajamento
         total_messages = len(message_logs)
@@ -180,7 +398,7 @@ class CRMAnalytics:
     @staticmethod
     def get_segment_analysis():
         """Análise por segmento de clientes"""
-        from src.models.campaign import Customer, MessageLog
+        from src.models.campaign import Customer, SegmentDailyRollup
         
         segments = db.session.query(
             Customer.segment,
@@ -189,20 +407,25 @@ class CRMAnalytics:
             db.func.avg(Customer.order_frequency).label('avg_frequency')
         ).group_by(Customer.segment).all()
         
+        # Mensagens por segmento e status, lidas dos rollups diários
+        message_rows = db.session.query(
+            SegmentDailyRollup.segment,
+            SegmentDailyRollup.status,
+            db.func.sum(SegmentDailyRollup.message_count).label('count')
+        ).group_by(SegmentDailyRollup.segment, SegmentDailyRollup.status).all()
+        
+        message_counts = {}
+        for row in message_rows:
+            # Clientes sem segmento ficam com '' no rollup
+            segment = row.segment or None
+            message_counts.setdefault(segment, {})[row.status] = int(row.count or 0)
+        
         segment_analysis = []
         
         for segment in segments:
-            # Buscar mensagens para este segmento
-            segment_customers = Customer.query.filter_by(segment=segment.segment).all()
-            customer_ids = [c.id for c in segment_customers]
-            
-            if customer_ids:
-                segment_messages = MessageLog.query.filter(MessageLog.customer_id.in_(customer_ids)).all()
-                successful_messages = len([m for m in segment_messages if m.status == 'sent'])
-                total_messages = len(segment_messages)
-            else:
-                successful_messages = 0
-                total_messages = 0
+            status_counts = message_counts.get(segment.segment, {})
+            successful_messages = status_counts.get('sent', 0)
+            total_messages = sum(status_counts.values())
             
             segment_analysis.append({
                 'segment': segment.segment,
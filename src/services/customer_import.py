@@ -0,0 +1,199 @@
+import logging
+import os
+import time
+from datetime import datetime
+import pandas as pd
+from src.models.auth import db
+from src.models.campaign import Customer
+from src.services.db_utils import dialect_insert, chunked
+from src.services.segmentation import segment_customers
+from src.services.cache import response_cache, CUSTOMERS_TAG
+
+logger = logging.getLogger(__name__)
+
+# Quantidade de linhas por lote de upsert
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+
+# Quantidade de linhas lidas do arquivo por vez na importação em streaming
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '10000'))
+
+# Limite de parâmetros por consulta IN ao buscar telefones existentes
+PHONE_LOOKUP_CHUNK = 500
+
+REQUIRED_COLUMNS = ['name', 'phone']
+OPTIONAL_COLUMNS = ['email', 'location', 'average_ticket', 'order_frequency', 'preferred_items']
+
+# Valores para clientes novos quando a coluna não existe ou está vazia
+NEW_CUSTOMER_DEFAULTS = {
+    'average_ticket': 0.0,
+    'order_frequency': 0
+}
+
+class CustomerImportError(ValueError):
+    """Arquivo de importação inválido"""
+
+class CustomerImporter:
+    """Importação de clientes em lote com upsert nativo do banco"""
+    
+    def __init__(self, user_id=None, batch_size=None):
+        self.user_id = user_id
+        self.batch_size = batch_size or IMPORT_BATCH_SIZE
+        self.imported_count = 0
+        self.updated_count = 0
+        self.skipped_count = 0
+        self.chunks_processed = 0
+        self.started_at = time.perf_counter()
+    
+    def missing_columns(self, df):
+        """Colunas obrigatórias ausentes no arquivo"""
+        return [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    
+    def import_stream(self, stream, progress_callback=None, chunk_size=None):
+        """Importar um CSV lendo e gravando bloco a bloco
+
+        Cada bloco é decodificado, gravado, segmentado e confirmado antes do
+        próximo ser lido, então a memória usada não depende do tamanho do
+        arquivo.
+        """
+        reader = pd.read_csv(
+            stream,
+            chunksize=chunk_size or IMPORT_CHUNK_SIZE,
+            dtype={'phone': str},
+            encoding='utf-8'
+        )
+        
+        with reader:
+            for chunk in reader:
+                if self.chunks_processed == 0:
+                    missing = self.missing_columns(chunk)
+                    if missing:
+                        raise CustomerImportError(
+                            f'Colunas obrigatórias: {REQUIRED_COLUMNS}. Encontradas: {list(chunk.columns)}'
+                        )
+                
+                # Gravar o bloco e segmentar só os clientes que ele tocou
+                phones = self.import_dataframe(chunk)
+                segment_customers(phones)
+                db.session.commit()
+                response_cache.invalidate(CUSTOMERS_TAG)
+                self.chunks_processed += 1
+                
+                stats = self.get_stats()
+                logger.info(f"Importação: bloco {self.chunks_processed} gravado, {stats['total']} clientes processados")
+                if progress_callback:
+                    progress_callback(stats)
+        
+        return self.get_stats()
+    
+    def import_dataframe(self, df):
+        """Inserir ou atualizar os clientes de um DataFrame, sem commit"""
+        columns = [col for col in OPTIONAL_COLUMNS if col in df.columns]
+        records = self._prepare_records(df, columns)
+        
+        for batch in chunked(records, self.batch_size):
+            existing_owners = self._fetch_existing_owners([r['phone'] for r in batch])
+            self._upsert(batch, columns, existing_owners)
+        
+        return [r['phone'] for r in records]
+    
+    def _prepare_records(self, df, columns):
+        """Normalizar as linhas do CSV em dicionários simples"""
+        df = df[REQUIRED_COLUMNS + columns].copy()
+        df['phone'] = df['phone'].astype('string').str.strip()
+        df['name'] = df['name'].astype('string').str.strip()
+        
+        valid = df['phone'].notna() & (df['phone'] != '') & df['name'].notna() & (df['name'] != '')
+        self.skipped_count += int((~valid).sum())
+        df = df[valid]
+        
+        # Telefones repetidos no arquivo: vale a última ocorrência
+        df = df.drop_duplicates(subset='phone', keep='last')
+        
+        if 'average_ticket' in columns:
+            df['average_ticket'] = pd.to_numeric(df['average_ticket'], errors='coerce')
+        if 'order_frequency' in columns:
+            df['order_frequency'] = pd.to_numeric(df['order_frequency'], errors='coerce')
+        
+        df = df.astype(object).where(df.notna(), None)
+        records = df.to_dict('records')
+        
+        for record in records:
+            if record.get('order_frequency') is not None:
+                record['order_frequency'] = int(record['order_frequency'])
+            if record.get('average_ticket') is not None:
+                record['average_ticket'] = float(record['average_ticket'])
+        
+        return records
+    
+    def _fetch_existing_owners(self, phones):
+        """Buscar em blocos os telefones já cadastrados e seus usuários"""
+        existing = {}
+        for chunk in chunked(phones, PHONE_LOOKUP_CHUNK):
+            rows = db.session.query(Customer.phone, Customer.user_id).filter(Customer.phone.in_(chunk))
+            existing.update((row.phone, row.user_id) for row in rows)
+        return existing
+    
+    def _upsert(self, batch, columns, existing_owners):
+        """Gravar um lote com INSERT ... ON CONFLICT (phone) DO UPDATE"""
+        now = datetime.utcnow()
+        rows = []
+        
+        for record in batch:
+            is_new = record['phone'] not in existing_owners
+            row = {
+                # Clientes existentes mantêm o dono atual
+                'user_id': self.user_id if is_new else existing_owners[record['phone']],
+                'name': record['name'],
+                'phone': record['phone'],
+                'updated_at': now
+            }
+            
+            for col in columns:
+                value = record.get(col)
+                if value is None and is_new:
+                    value = NEW_CUSTOMER_DEFAULTS.get(col)
+                row[col] = value
+            
+            if is_new:
+                for col, default in NEW_CUSTOMER_DEFAULTS.items():
+                    row.setdefault(col, default)
+                self.imported_count += 1
+            else:
+                self.updated_count += 1
+            
+            rows.append(row)
+        
+        # Clientes novos e existentes precisam das mesmas colunas no lote
+        all_columns = set().union(*(row.keys() for row in rows))
+        for row in rows:
+            for col in all_columns:
+                row.setdefault(col, None)
+        
+        table = Customer.__table__
+        stmt = dialect_insert(table)
+        
+        # Células vazias mantêm o valor já cadastrado
+        update_set = {
+            'name': stmt.excluded.name,
+            'updated_at': stmt.excluded.updated_at
+        }
+        for col in columns:
+            update_set[col] = db.func.coalesce(stmt.excluded[col], table.c[col])
+        
+        stmt = stmt.on_conflict_do_update(index_elements=['phone'], set_=update_set)
+        db.session.execute(stmt, rows)
+    
+    def get_stats(self):
+        """Contadores e velocidade da importação"""
+        elapsed = time.perf_counter() - self.started_at
+        total = self.imported_count + self.updated_count
+        
+        return {
+            'imported': self.imported_count,
+            'updated': self.updated_count,
+            'skipped': self.skipped_count,
+            'total': total,
+            'chunks': self.chunks_processed,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(total / elapsed, 1) if elapsed > 0 else 0
+        }
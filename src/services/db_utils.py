@@ -0,0 +1,18 @@
+from sqlalchemy.dialects import postgresql, sqlite
+from src.models.auth import db
+
+def dialect_insert(table):
+    """INSERT do dialeto em uso, com suporte a ON CONFLICT (upsert)"""
+    dialect = db.session.get_bind().dialect.name
+    
+    if dialect == 'postgresql':
+        return postgresql.insert(table)
+    if dialect == 'sqlite':
+        return sqlite.insert(table)
+    
+    raise Exception(f"Upsert não suportado para o banco {dialect}")
+
+def chunked(items, size):
+    """Dividir uma sequência em blocos de tamanho fixo"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
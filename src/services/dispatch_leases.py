@@ -0,0 +1,85 @@
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from src.models.auth import db
+from src.models.campaign import CampaignDispatch
+
+logger = logging.getLogger(__name__)
+
+# Duração do lease de um disparo em execução; renovado a cada lote de logs
+DISPATCH_LEASE_SECONDS = int(os.getenv('DISPATCH_LEASE_SECONDS', '300'))
+
+class DispatchNotClaimable(Exception):
+    """Disparo que não está agendado ou já foi assumido por outro worker"""
+
+class DispatchLeaseLost(Exception):
+    """O lease do disparo expirou e foi assumido por outro worker"""
+
+def new_lease_owner():
+    """Identificador único do dono de um lease (host, processo e execução)"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def lease_expiration():
+    """Novo vencimento do lease, contado a partir de agora"""
+    return datetime.utcnow() + timedelta(seconds=DISPATCH_LEASE_SECONDS)
+
+def claim_dispatch(dispatch_id, owner, statuses=('scheduled',)):
+    """Assumir um disparo de forma atômica, com um único UPDATE condicional
+
+    Só um worker consegue passar o disparo de um dos status aceitos
+    (normalmente 'scheduled') para 'running'; disparos 'running' com lease
+    vencido também podem ser assumidos. Retorna True se o disparo ficou
+    com este dono.
+    """
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        db.update(CampaignDispatch)
+        .where(
+            CampaignDispatch.id == dispatch_id,
+            db.or_(
+                CampaignDispatch.status.in_(statuses),
+                db.and_(
+                    CampaignDispatch.status == 'running',
+                    CampaignDispatch.lease_expires_at < now
+                )
+            )
+        )
+        .values(status='running', lease_owner=owner, lease_expires_at=lease_expiration()),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    db.session.commit()
+    return claimed == 1
+
+def release_dispatch(dispatch_id, owner, status, **values):
+    """Encerrar o lease gravando o status final, se o lease ainda é deste dono"""
+    released = db.session.execute(
+        db.update(CampaignDispatch)
+        .where(
+            CampaignDispatch.id == dispatch_id,
+            CampaignDispatch.status == 'running',
+            CampaignDispatch.lease_owner == owner
+        )
+        .values(status=status, lease_owner=None, lease_expires_at=None, **values),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    db.session.commit()
+    return released == 1
+
+def recover_expired_leases():
+    """Devolver à fila os disparos cujo worker parou de renovar o lease"""
+    recovered = db.session.execute(
+        db.update(CampaignDispatch)
+        .where(
+            CampaignDispatch.status == 'running',
+            CampaignDispatch.lease_expires_at < datetime.utcnow()
+        )
+        .values(status='scheduled', lease_owner=None, lease_expires_at=None),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    db.session.commit()
+
+    if recovered:
+        logger.warning(f"{recovered} disparos com lease vencido voltaram para a fila")
+    return recovered
@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from src.models.auth import db
+from src.services.messaging import CampaignExecutor
+from src.services.dispatch_leases import DispatchNotClaimable
+
+logger = logging.getLogger(__name__)
+
+# Limites de disparos executados ao mesmo tempo
+DISPATCH_MAX_PARALLEL = int(os.getenv('DISPATCH_MAX_PARALLEL', '4'))
+DISPATCH_MAX_PER_CAMPAIGN = int(os.getenv('DISPATCH_MAX_PER_CAMPAIGN', '1'))
+
+class DispatchOrchestrator:
+    """Executa disparos em paralelo, revezando entre campanhas
+
+    Roda até DISPATCH_MAX_PARALLEL disparos ao mesmo tempo e no máximo
+    DISPATCH_MAX_PER_CAMPAIGN por campanha. A próxima vaga vai para a
+    campanha seguinte na fila (round-robin), então um grupo lento não
+    segura as demais campanhas. O ritmo total de envio continua limitado
+    pelo semáforo e pelo rate limiter da instância, compartilhados por
+    todos os disparos do processo.
+    """
+
+    def __init__(self, app, whatsapp_service, max_parallel=None, max_per_campaign=None):
+        self.app = app
+        self.whatsapp_service = whatsapp_service
+        self.max_parallel = max_parallel or DISPATCH_MAX_PARALLEL
+        self.max_per_campaign = max_per_campaign or DISPATCH_MAX_PER_CAMPAIGN
+
+        self._queues = OrderedDict()
+        self._running = Counter()
+        self._futures = {}
+        self._active = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_parallel)
+
+    def submit(self, dispatch_id, campaign_id, on_start=None, mark_failed=False):
+        """Enfileirar um disparo, retornando um Future com o resultado
+
+        Um disparo já na fila ou em execução não é enfileirado de novo.
+        Com mark_failed, uma execução com erro deixa o disparo como 'failed'
+        em vez de devolvê-lo à fila. Cancelar o Future antes do início
+        descarta o disparo.
+        """
+        with self._lock:
+            future = self._futures.get(dispatch_id)
+            if future is not None:
+                return future
+
+            future = Future()
+            self._futures[dispatch_id] = future
+            self._queues.setdefault(campaign_id, deque()).append((dispatch_id, future, on_start, mark_failed))
+            self._pump()
+            return future
+
+    def cancel_pending(self):
+        """Descartar os disparos que ainda não começaram"""
+        with self._lock:
+            for queue in self._queues.values():
+                for dispatch_id, future, _, _ in queue:
+                    self._futures.pop(dispatch_id, None)
+                    future.cancel()
+            self._queues.clear()
+
+    def shutdown(self, wait=True):
+        """Cancelar a fila e encerrar os workers"""
+        self.cancel_pending()
+        self._pool.shutdown(wait=wait)
+
+    def get_metrics(self):
+        """Disparos em execução e na fila"""
+        with self._lock:
+            return {
+                'running': self._active,
+                'queued': sum(len(queue) for queue in self._queues.values()),
+                'running_by_campaign': {str(k): v for k, v in self._running.items() if v},
+                'max_parallel': self.max_parallel,
+                'max_per_campaign': self.max_per_campaign
+            }
+
+    def _pump(self):
+        """Ocupar as vagas livres, revezando entre campanhas (com o lock)"""
+        while self._active < self.max_parallel:
+            campaign_id = next(
+                (c for c, queue in self._queues.items() if queue and self._running[c] < self.max_per_campaign),
+                None
+            )
+            if campaign_id is None:
+                return
+
+            queue = self._queues[campaign_id]
+            dispatch_id, future, on_start, mark_failed = queue.popleft()
+            if queue:
+                self._queues.move_to_end(campaign_id)
+            else:
+                del self._queues[campaign_id]
+            
+            # Disparo cancelado por quem o enfileirou
+            if not future.set_running_or_notify_cancel():
+                self._futures.pop(dispatch_id, None)
+                continue
+
+            self._running[campaign_id] += 1
+            self._active += 1
+            self._pool.submit(self._run, dispatch_id, campaign_id, future, on_start, mark_failed)
+
+    def _run(self, dispatch_id, campaign_id, future, on_start, mark_failed):
+        try:
+            if on_start:
+                on_start()
+            future.set_result(self._execute(dispatch_id, mark_failed))
+        except Exception as e:
+            future.set_result({'dispatch_id': dispatch_id, 'error': str(e)})
+        finally:
+            with self._lock:
+                self._futures.pop(dispatch_id, None)
+                self._running[campaign_id] -= 1
+                self._active -= 1
+                self._pump()
+
+    def _execute(self, dispatch_id, mark_failed):
+        """Executar um disparo em um contexto de aplicação próprio"""
+        with self.app.app_context():
+            try:
+                # Falhas só viram 'failed' pelo próprio dono do lease
+                return CampaignExecutor(self.whatsapp_service).execute_dispatch(
+                    dispatch_id,
+                    failure_status='failed' if mark_failed else 'scheduled'
+                )
+            except DispatchNotClaimable as e:
+                # Já assumido por outro worker ou não está mais agendado
+                logger.info(f"Disparo {dispatch_id} ignorado: {str(e)}")
+                db.session.rollback()
+                return {'dispatch_id': dispatch_id, 'error': str(e), 'skipped': True}
+            except Exception as e:
+                logger.error(f"Erro ao executar disparo {dispatch_id}: {str(e)}")
+                db.session.rollback()
+                return {'dispatch_id': dispatch_id, 'error': str(e)}
+
+_orchestrator = None
+_orchestrator_lock = threading.Lock()
+
+def get_dispatch_orchestrator(app, whatsapp_service):
+    """Obter o orquestrador compartilhado do processo, criado no primeiro uso
+
+    Agendador e execuções manuais usam a mesma instância, então os limites
+    de paralelismo valem para o processo inteiro.
+    """
+    global _orchestrator
+    with _orchestrator_lock:
+        if _orchestrator is None:
+            _orchestrator = DispatchOrchestrator(app, whatsapp_service)
+        return _orchestrator
+
+def shutdown_dispatch_orchestrator(wait=True):
+    """Encerrar o orquestrador compartilhado; o próximo uso cria outro"""
+    global _orchestrator
+    with _orchestrator_lock:
+        orchestrator, _orchestrator = _orchestrator, None
+    if orchestrator:
+        orchestrator.shutdown(wait=wait)
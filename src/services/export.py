@@ -0,0 +1,169 @@
+import csv
+import io
+import json
+import os
+import zlib
+from src.models.auth import db
+from src.models.campaign import Customer
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet é opcional
+    pa = None
+    pq = None
+
+# Linhas lidas do banco por vez durante a exportação
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet')
+}
+
+# Campo, cabeçalho do CSV e coluna de cada valor exportado
+CUSTOMER_EXPORT_FIELDS = [
+    ('id', 'ID', Customer.id),
+    ('name', 'Nome', Customer.name),
+    ('phone', 'Telefone', Customer.phone),
+    ('email', 'Email', Customer.email),
+    ('location', 'Localização', Customer.location),
+    ('average_ticket', 'Ticket Médio', Customer.average_ticket),
+    ('order_frequency', 'Frequência', Customer.order_frequency),
+    ('segment', 'Segmento', Customer.segment),
+    ('last_order_date', 'Último Pedido', Customer.last_order_date)
+]
+
+class ExportError(ValueError):
+    """Formato de exportação inválido ou indisponível"""
+
+def validate_export_format(export_format):
+    """Validar o formato pedido, levantando ExportError"""
+    if export_format not in EXPORT_FORMATS:
+        raise ExportError(f"Formato inválido: {export_format}. Use: {', '.join(EXPORT_FORMATS)}")
+    if export_format == 'parquet' and pa is None:
+        raise ExportError('Exportação em Parquet requer o pacote pyarrow instalado')
+
+def _iter_customer_batches(segment=None):
+    """Ler os clientes em lotes com yield_per, sem carregar a tabela inteira"""
+    stmt = db.select(*[column for _, _, column in CUSTOMER_EXPORT_FIELDS]).order_by(Customer.id)
+    if segment:
+        stmt = stmt.where(Customer.segment == segment)
+
+    result = db.session.execute(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    for rows in result.partitions():
+        yield rows
+
+def _iter_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([header for _, header, _ in CUSTOMER_EXPORT_FIELDS])
+
+    for rows in batches:
+        for c in rows:
+            writer.writerow([
+                c.id,
+                c.name,
+                c.phone,
+                c.email or '',
+                c.location or '',
+                c.average_ticket or 0,
+                c.order_frequency or 0,
+                c.segment or '',
+                c.last_order_date.strftime('%Y-%m-%d') if c.last_order_date else ''
+            ])
+
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def _iter_ndjson(batches):
+    for rows in batches:
+        lines = []
+        for row in rows:
+            record = row._asdict()
+            if record['last_order_date']:
+                record['last_order_date'] = record['last_order_date'].isoformat()
+            lines.append(json.dumps(record, ensure_ascii=False))
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+class _ChunkSink(io.RawIOBase):
+    """Arquivo em memória que entrega o que foi escrito e é esvaziado em seguida"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def _parquet_schema():
+    return pa.schema([
+        ('id', pa.int64()),
+        ('name', pa.string()),
+        ('phone', pa.string()),
+        ('email', pa.string()),
+        ('location', pa.string()),
+        ('average_ticket', pa.float64()),
+        ('order_frequency', pa.int64()),
+        ('segment', pa.string()),
+        ('last_order_date', pa.timestamp('us'))
+    ])
+
+def _iter_parquet(batches):
+    # Cada lote vira um row group, entregue assim que é gravado
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+
+    for rows in batches:
+        writer.write_table(pa.Table.from_pylist([row._asdict() for row in rows], schema=schema))
+        data = sink.drain()
+        if data:
+            yield data
+
+    writer.close()
+    yield sink.drain()
+
+def _gzip(chunks):
+    """Comprimir em gzip à medida que os blocos são gerados"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_customer_export(export_format='csv', segment=None, compress=False):
+    """Gerador com o conteúdo da exportação de clientes, em memória constante"""
+    batches = _iter_customer_batches(segment)
+
+    if export_format == 'ndjson':
+        chunks = _iter_ndjson(batches)
+    elif export_format == 'parquet':
+        chunks = _iter_parquet(batches)
+    else:
+        chunks = _iter_csv(batches)
+
+    # Parquet já é comprimido internamente
+    if compress and export_format != 'parquet':
+        return _gzip(chunks)
+    return chunks
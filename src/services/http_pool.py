@@ -0,0 +1,67 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Configurações do pool de conexões HTTP
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', '4'))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', os.getenv('EVOLUTION_MAX_CONCURRENCY', '10')))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '30'))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '3'))
+HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', '0.5'))
+
+# Timeout padrão (conexão, leitura) para as chamadas
+DEFAULT_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def _build_retry():
+    """Política de retry de transporte
+
+    Falhas de conexão são sempre repetidas, pois a requisição não chegou ao
+    servidor. Erros de leitura e status 502/503/504 só são repetidos em
+    métodos idempotentes, para nunca duplicar o envio de uma mensagem.
+    """
+    return Retry(
+        total=HTTP_MAX_RETRIES,
+        connect=HTTP_MAX_RETRIES,
+        read=HTTP_MAX_RETRIES,
+        status=HTTP_MAX_RETRIES,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        raise_on_status=False
+    )
+
+def _build_session():
+    """Criar uma sessão com pool de conexões keep-alive"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        pool_block=True,
+        max_retries=_build_retry()
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_session(base_url):
+    """Obter a sessão compartilhada do processo para uma URL base"""
+    key = base_url.rstrip('/')
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _build_session()
+            _sessions[key] = session
+        return session
+
+def close_sessions():
+    """Fechar todas as sessões e liberar os sockets"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from src.models.auth import db
+from src.models.job import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+# Configurações da fila de tarefas em segundo plano
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '2'))
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', '900'))
+JOB_RECOVERY_INTERVAL = float(os.getenv('JOB_RECOVERY_INTERVAL', '60'))
+
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+jobs_table = BackgroundJob.__table__
+
+def _dumps(value):
+    return json.dumps(value, default=str) if value is not None else None
+
+class JobCancelled(Exception):
+    """Tarefa cancelada a pedido do usuário"""
+
+class JobContext:
+    """Acesso da tarefa em execução ao seu payload, progresso e cancelamento"""
+    
+    def __init__(self, job_queue, job_id, payload):
+        self.job_queue = job_queue
+        self.job_id = job_id
+        self.payload = payload
+    
+    def update_progress(self, progress):
+        """Registrar o progresso atual da tarefa"""
+        self.job_queue._update(
+            self.job_id,
+            progress=_dumps(progress),
+            heartbeat_at=datetime.utcnow()
+        )
+    
+    def check_cancelled(self):
+        """Interromper a tarefa se o cancelamento foi solicitado"""
+        with db.engine.connect() as conn:
+            cancel_requested = conn.execute(
+                db.select(jobs_table.c.cancel_requested).where(jobs_table.c.id == self.job_id)
+            ).scalar()
+        
+        if cancel_requested:
+            raise JobCancelled(f"Tarefa {self.job_id} cancelada")
+
+class JobQueue:
+    """Fila de tarefas persistida no banco e executada por threads do processo
+
+    A tabela background_jobs é a própria fila: as threads reservam tarefas
+    com um UPDATE condicional, então vários processos podem compartilhá-la.
+    O controle da tarefa usa conexões próprias, separadas da sessão em que
+    o handler trabalha. Tarefas que dependem de arquivos locais podem ser
+    fixadas no host que as criou.
+    """
+    
+    def __init__(self):
+        self.app = None
+        self.handlers = {}
+        self.cancel_handlers = {}
+        self.threads = []
+        self.node = socket.gethostname()
+        self.worker_id = f"{self.node}:{os.getpid()}"
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._last_recovery = None
+    
+    def init_app(self, app, start_workers=True):
+        """Associar a fila à aplicação e iniciar as threads de trabalho"""
+        self.app = app
+        
+        with app.app_context():
+            self._recover_stale_jobs_if_due()
+        
+        if start_workers:
+            self.start()
+    
+    def register(self, job_type, handler, on_cancel=None):
+        """Registrar a função que executa um tipo de tarefa
+
+        on_cancel recebe o payload de uma tarefa cancelada antes de começar,
+        para liberar o que ela usaria (ex.: arquivos enviados).
+        """
+        self.handlers[job_type] = handler
+        if on_cancel:
+            self.cancel_handlers[job_type] = on_cancel
+        return handler
+    
+    def enqueue(self, job_type, payload=None, user_id=None, pin_to_node=False):
+        """Criar uma tarefa na fila e devolver seu id
+
+        Com pin_to_node, só workers deste host podem executar a tarefa.
+        """
+        if job_type not in self.handlers:
+            raise Exception(f"Tipo de tarefa desconhecido: {job_type}")
+        
+        job = BackgroundJob(
+            id=str(uuid.uuid4()),
+            job_type=job_type,
+            status='queued',
+            payload=_dumps(payload or {}),
+            user_id=user_id,
+            node=self.node if pin_to_node else None
+        )
+        db.session.add(job)
+        db.session.commit()
+        
+        self.start()
+        self._wakeup.set()
+        
+        return job.id
+    
+    def cancel(self, job_id):
+        """Cancelar uma tarefa: imediato se na fila, cooperativo se em execução"""
+        with db.engine.begin() as conn:
+            cancelled = conn.execute(
+                db.update(jobs_table)
+                .where(jobs_table.c.id == job_id, jobs_table.c.status == 'queued')
+                .values(status='cancelled', cancel_requested=True, finished_at=datetime.utcnow())
+            ).rowcount
+            
+            if cancelled:
+                job = conn.execute(
+                    db.select(jobs_table.c.job_type, jobs_table.c.payload).where(jobs_table.c.id == job_id)
+                ).one()
+            else:
+                conn.execute(
+                    db.update(jobs_table)
+                    .where(jobs_table.c.id == job_id, jobs_table.c.status == 'running')
+                    .values(cancel_requested=True)
+                )
+        
+        on_cancel = self.cancel_handlers.get(job.job_type) if cancelled else None
+        if on_cancel:
+            try:
+                on_cancel(json.loads(job.payload or '{}'))
+            except Exception as e:
+                logger.error(f"Erro ao liberar a tarefa cancelada {job_id}: {str(e)}")
+    
+    def start(self):
+        """Iniciar as threads de trabalho, se ainda não estiverem rodando"""
+        if self.app is None or JOB_WORKERS <= 0:
+            return
+        
+        with self._lock:
+            self.threads = [t for t in self.threads if t.is_alive()]
+            self._stopping.clear()
+            
+            for index in range(len(self.threads), JOB_WORKERS):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f'job-worker-{index + 1}',
+                    daemon=True
+                )
+                thread.start()
+                self.threads.append(thread)
+    
+    def stop(self):
+        """Parar as threads após a tarefa em andamento"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+    
+    def _worker_loop(self):
+        """Loop de cada thread: reservar e executar tarefas da fila"""
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    self._recover_stale_jobs_if_due()
+                    job_id = self._claim_next()
+                    if job_id:
+                        self._run(job_id)
+                        continue
+            except Exception as e:
+                logger.error(f"Erro na fila de tarefas: {str(e)}")
+            
+            self._wakeup.wait(JOB_POLL_INTERVAL)
+            self._wakeup.clear()
+    
+    def _claim_next(self):
+        """Reservar a tarefa mais antiga da fila com um UPDATE condicional"""
+        with db.engine.begin() as conn:
+            candidates = conn.execute(
+                db.select(jobs_table.c.id)
+                .where(
+                    jobs_table.c.status == 'queued',
+                    db.or_(jobs_table.c.node.is_(None), jobs_table.c.node == self.node)
+                )
+                .order_by(jobs_table.c.created_at)
+                .limit(5)
+            ).scalars().all()
+            
+            now = datetime.utcnow()
+            for job_id in candidates:
+                claimed = conn.execute(
+                    db.update(jobs_table)
+                    .where(jobs_table.c.id == job_id, jobs_table.c.status == 'queued')
+                    .values(status='running', worker_id=self.worker_id, started_at=now, heartbeat_at=now)
+                ).rowcount
+                if claimed:
+                    return job_id
+        
+        return None
+    
+    def _run(self, job_id):
+        """Executar uma tarefa reservada e gravar o resultado"""
+        job = db.session.get(BackgroundJob, job_id)
+        handler = self.handlers.get(job.job_type)
+        context = JobContext(self, job_id, json.loads(job.payload or '{}'))
+        db.session.commit()
+        
+        logger.info(f"Executando tarefa {job_id} ({job.job_type})")
+        
+        # Sinal de vida periódico, para a tarefa não ser tomada como interrompida
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, stop_heartbeat), daemon=True)
+        heartbeat.start()
+        
+        try:
+            if handler is None:
+                raise Exception(f"Tipo de tarefa desconhecido: {job.job_type}")
+            
+            result = handler(context)
+            self._finish(job_id, 'succeeded', result=_dumps(result))
+            logger.info(f"Tarefa {job_id} concluída")
+        except JobCancelled:
+            db.session.rollback()
+            self._finish(job_id, 'cancelled')
+            logger.info(f"Tarefa {job_id} cancelada")
+        except Exception as e:
+            db.session.rollback()
+            self._finish(job_id, 'failed', error_message=str(e))
+            logger.error(f"Erro na tarefa {job_id}: {str(e)}")
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+    
+    def _heartbeat(self, job_id, stop):
+        """Atualizar heartbeat_at enquanto a tarefa roda"""
+        while not stop.wait(JOB_STALE_SECONDS / 3):
+            try:
+                with self.app.app_context(), db.engine.begin() as conn:
+                    conn.execute(
+                        db.update(jobs_table)
+                        .where(jobs_table.c.id == job_id, jobs_table.c.status == 'running')
+                        .values(heartbeat_at=datetime.utcnow())
+                    )
+            except Exception as e:
+                logger.error(f"Erro ao registrar sinal de vida da tarefa {job_id}: {str(e)}")
+    
+    def _finish(self, job_id, status, **values):
+        now = datetime.utcnow()
+        self._update(job_id, status=status, finished_at=now, heartbeat_at=now, **values)
+    
+    def _update(self, job_id, **values):
+        with db.engine.begin() as conn:
+            conn.execute(db.update(jobs_table).where(jobs_table.c.id == job_id).values(**values))
+    
+    def _recover_stale_jobs_if_due(self):
+        """Recuperar tarefas interrompidas no máximo uma vez por intervalo"""
+        with self._lock:
+            now = time.monotonic()
+            if self._last_recovery is not None and now - self._last_recovery < JOB_RECOVERY_INTERVAL:
+                return
+            self._last_recovery = now
+        
+        self._recover_stale_jobs()
+    
+    def _recover_stale_jobs(self):
+        """Marcar como falhas as tarefas em execução sem sinal de vida"""
+        limit = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        
+        with db.engine.begin() as conn:
+            recovered = conn.execute(
+                db.update(jobs_table)
+                .where(jobs_table.c.status == 'running', jobs_table.c.heartbeat_at < limit)
+                .values(
+                    status='failed',
+                    error_message='Tarefa interrompida antes de terminar',
+                    finished_at=datetime.utcnow()
+                )
+            ).rowcount
+        
+        if recovered:
+            logger.info(f"{recovered} tarefas interrompidas marcadas como falha")
+
+# Instância global da fila de tarefas
+job_queue = JobQueue()
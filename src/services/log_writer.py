@@ -0,0 +1,189 @@
+import os
+import time
+from src.models.auth import db
+from src.models.campaign import MessageLog, CampaignDispatch
+from src.services.rollups import RollupCounter
+from src.services.db_utils import dialect_insert
+from src.services.cache import response_cache, DISPATCHES_TAG
+from src.services.dispatch_leases import DispatchLeaseLost, lease_expiration, DISPATCH_LEASE_SECONDS
+
+# Gravação em lote dos logs de mensagens durante um disparo
+MESSAGE_LOG_BATCH_SIZE = int(os.getenv('MESSAGE_LOG_BATCH_SIZE', '50'))
+MESSAGE_LOG_FLUSH_MS = int(os.getenv('MESSAGE_LOG_FLUSH_MS', '1000'))
+
+def logged_counters(dispatch_id):
+    """Contadores do disparo recalculados pelos logs com resultado, como subconsultas de UPDATE"""
+    def count(status):
+        return (
+            db.select(db.func.count(MessageLog.id))
+            .where(MessageLog.dispatch_id == dispatch_id, MessageLog.status == status)
+            .scalar_subquery()
+        )
+    return {'success_count': count('sent'), 'failed_count': count('failed')}
+
+class MessageLogWriter:
+    """Checkpoint e resultado dos envios de um disparo, gravados em lote
+
+    Antes do envio, reserve() grava um log 'pending' por cliente: com o
+    índice único (dispatch_id, customer_id) cada cliente só é reservado uma
+    vez, então uma execução retomada não envia de novo a quem já recebeu (ou
+    pode ter recebido) a mensagem. Os resultados atualizam esses logs em
+    lotes, confirmados junto com o incremento dos contadores do disparo e
+    dos rollups, e as métricas nunca divergem dos logs. Com um dono de
+    lease, cada gravação também renova o lease do disparo; depois que o
+    lease é perdido, os resultados continuam sendo gravados nos logs
+    reservados, mas os contadores são recalculados pelos logs.
+    """
+    
+    # Colunas do log preenchidas com o resultado do envio
+    RESULT_FIELDS = ('status', 'sent_date', 'whatsapp_message_id', 'error_message', 'image_path')
+    
+    def __init__(self, dispatch_id, dispatch_number, batch_size=None, flush_interval_ms=None,
+                 lease_owner=None):
+        self.dispatch_id = dispatch_id
+        self.dispatch_number = dispatch_number
+        self.lease_owner = lease_owner
+        self.lease_lost = False
+        self.lease_renewed_at = time.monotonic()
+        self.batch_size = batch_size or MESSAGE_LOG_BATCH_SIZE
+        self.flush_interval = (flush_interval_ms or MESSAGE_LOG_FLUSH_MS) / 1000.0
+        self.pending = []
+        self.success_count = 0
+        self.failed_count = 0
+        self.last_flush = time.monotonic()
+    
+    def reserve(self, rows):
+        """Gravar logs 'pending' antes do envio, retornando {id do cliente: id do log}
+
+        Clientes que já têm log no disparo ficam de fora e não devem ser enviados.
+        """
+        if not rows:
+            return {}
+        
+        insert = dialect_insert(MessageLog.__table__).on_conflict_do_nothing()
+        reserved = dict(db.session.execute(
+            insert.returning(MessageLog.customer_id, MessageLog.id),
+            rows
+        ).all())
+        if self.lease_owner:
+            self._update_dispatch()
+        db.session.commit()
+        return reserved
+    
+    def discard(self, log_ids):
+        """Apagar reservas cujo envio nem começou, para serem enviadas numa nova execução"""
+        if not log_ids:
+            return
+        
+        db.session.execute(
+            db.delete(MessageLog).where(MessageLog.id.in_(log_ids), MessageLog.status == 'pending'),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+    
+    def add(self, row, segment=None):
+        """Adicionar o resultado de um log reservado ao buffer, gravando se o lote estiver cheio"""
+        self.pending.append((row, segment))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+    
+    def time_until_flush(self):
+        """Segundos até a próxima gravação por tempo"""
+        return max(0.0, self.last_flush + self.flush_interval - time.monotonic())
+    
+    def flush_if_due(self):
+        """Gravar o buffer se o intervalo máximo já passou"""
+        if self.time_until_flush() <= 0:
+            self.flush()
+    
+    def flush(self):
+        """Gravar os resultados pendentes e atualizar os contadores do disparo
+
+        O buffer só é esvaziado após o commit, então uma gravação que falhou
+        pode ser repetida. Com o lease perdido, só logs ainda 'pending' são
+        atualizados (e somados aos rollups) e os contadores do disparo são
+        recalculados pelos logs, sem a guarda do lease.
+        """
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            # Sem mensagens novas (ex.: envio pausado), só manter o lease vivo
+            if (self.lease_owner and not self.lease_lost
+                    and self.last_flush - self.lease_renewed_at >= DISPATCH_LEASE_SECONDS / 3):
+                self._update_dispatch()
+                db.session.commit()
+            return
+        
+        pending = self.pending
+        if self.lease_lost:
+            still_pending = set(db.session.scalars(
+                db.select(MessageLog.id).where(
+                    MessageLog.id.in_([row['id'] for row, _ in pending]),
+                    MessageLog.status == 'pending'
+                )
+            ))
+            pending = [(row, segment) for row, segment in pending if row['id'] in still_pending]
+        
+        rollups = RollupCounter()
+        for row, segment in pending:
+            rollups.add(row, self.dispatch_number, segment)
+        
+        success = sum(1 for row, _ in pending if row['status'] == 'sent')
+        failed = len(pending) - success
+        
+        # UPDATE em massa pela chave primária dos logs reservados
+        if pending:
+            db.session.execute(db.update(MessageLog), [
+                dict({'id': row['id']}, **{field: row[field] for field in self.RESULT_FIELDS})
+                for row, _ in pending
+            ])
+        if self.lease_lost:
+            db.session.execute(
+                db.update(CampaignDispatch)
+                .where(CampaignDispatch.id == self.dispatch_id)
+                .values(**logged_counters(self.dispatch_id)),
+                execution_options={'synchronize_session': False}
+            )
+        else:
+            try:
+                self._update_dispatch(
+                    success_count=db.func.coalesce(CampaignDispatch.success_count, 0) + success,
+                    failed_count=db.func.coalesce(CampaignDispatch.failed_count, 0) + failed
+                )
+            except DispatchLeaseLost:
+                # O rollback desfez o UPDATE dos logs: gravar de novo, sem o lease
+                self.flush()
+                raise
+        rollups.apply()
+        db.session.commit()
+        response_cache.invalidate(DISPATCHES_TAG)
+        
+        self.pending = []
+        self.success_count += success
+        self.failed_count += failed
+    
+    def set_counters(self, success_count, failed_count):
+        """Gravar os contadores do disparo com valores absolutos, se o lease ainda é deste worker"""
+        self._update_dispatch(success_count=success_count, failed_count=failed_count)
+        db.session.commit()
+        self.success_count = success_count
+        self.failed_count = failed_count
+    
+    def _update_dispatch(self, **values):
+        """Atualizar o disparo e renovar o lease, na transação atual
+
+        Interrompe o disparo se o lease passou para outro worker; o buffer
+        fica intacto para ser gravado sem o lease.
+        """
+        stmt = db.update(CampaignDispatch).where(CampaignDispatch.id == self.dispatch_id).values(**values)
+        if self.lease_owner:
+            stmt = stmt.where(
+                CampaignDispatch.status == 'running',
+                CampaignDispatch.lease_owner == self.lease_owner
+            ).values(lease_expires_at=lease_expiration())
+        
+        updated = db.session.execute(stmt, execution_options={'synchronize_session': False}).rowcount
+        if self.lease_owner and not updated:
+            db.session.rollback()
+            self.lease_lost = True
+            raise DispatchLeaseLost(f"Lease do disparo {self.dispatch_id} foi perdido")
+        self.lease_renewed_at = time.monotonic()
@@ -0,0 +1,89 @@
+import base64
+import os
+import threading
+from collections import OrderedDict
+
+# Limite de memória do cache de mídias já codificadas
+MEDIA_CACHE_MAX_BYTES = int(os.getenv('MEDIA_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+class MediaCache:
+    """Cache LRU de mídias locais já convertidas em data URI base64
+
+    A chave inclui o mtime e o tamanho do arquivo, então uma imagem
+    substituída no disco é recodificada automaticamente.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or MEDIA_CACHE_MAX_BYTES
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _key(self, media_path):
+        stat = os.stat(media_path)
+        return (os.path.abspath(media_path), stat.st_mtime_ns, stat.st_size)
+
+    def _lookup(self, key):
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return payload
+
+    def _store(self, key, payload):
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            # Descartar versões antigas do mesmo arquivo
+            for stale_key in [k for k in self._entries if k[0] == key[0] and k != key]:
+                self.current_bytes -= len(self._entries.pop(stale_key))
+
+            if key not in self._entries:
+                self._entries[key] = payload
+                self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def get_data_uri(self, media_path):
+        """Obter a mídia local codificada, lendo o disco só na primeira vez"""
+        key = self._key(media_path)
+        payload = self._lookup(key)
+        if payload is not None:
+            return payload
+
+        # Evitar que várias threads codifiquem o mesmo arquivo ao mesmo tempo
+        with self._load_lock:
+            payload = self._lookup(key)
+            if payload is not None:
+                return payload
+
+            with self._lock:
+                self.misses += 1
+
+            with open(media_path, 'rb') as f:
+                media_base64 = base64.b64encode(f.read()).decode()
+            payload = f"data:image/jpeg;base64,{media_base64}"
+            self._store(key, payload)
+            return payload
+
+    def get_stats(self):
+        """Estatísticas de uso do cache"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+# Instância global do cache de mídias
+media_cache = MediaCache()
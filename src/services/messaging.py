@@ -1,12 +1,46 @@
 import requests
 import json
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
 from datetime import datetime
 import os
-from src.models.campaign import MessageLog, CampaignDispatch, Customer
-from src.models.user import db
+from src.models.campaign import MessageLog, CampaignDispatch, Customer, CampaignGroupMember, CUSTOMER_GROUP_SIZE
+from src.models.auth import db
+from src.services.http_pool import get_session, DEFAULT_TIMEOUT
+from src.services.rate_limiter import get_rate_limiter
+from src.services.media_cache import media_cache
+from src.services.templates import compile_template
+from src.services.log_writer import MessageLogWriter, logged_counters
+from src.services.cache import response_cache, DISPATCHES_TAG
+from src.services.dispatch_leases import (
+    DispatchNotClaimable, DispatchLeaseLost, new_lease_owner, claim_dispatch, release_dispatch
+)
+
+logger = logging.getLogger(__name__)
+
+# Limite de envios simultâneos por instância da Evolution API
+EVOLUTION_MAX_CONCURRENCY = int(os.getenv('EVOLUTION_MAX_CONCURRENCY', '10'))
+
+_instance_semaphores = {}
+_instance_semaphores_lock = threading.Lock()
+
+def get_instance_semaphore(instance_name):
+    """Obter o semáforo que limita os envios simultâneos de uma instância"""
+    with _instance_semaphores_lock:
+        semaphore = _instance_semaphores.get(instance_name)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(EVOLUTION_MAX_CONCURRENCY)
+            _instance_semaphores[instance_name] = semaphore
+        return semaphore
+
+# Dados do cliente necessários para o envio, desacoplados da sessão do banco
+DispatchRecipient = namedtuple('DispatchRecipient', ['id', 'phone', 'name', 'preferred_items', 'segment'])
 
 class WhatsAppService:
-    def __init__(self, evolution_api_url, api_key, instance_name):
+    def __init__(self, evolution_api_url, api_key, instance_name, timeout=None):
         self.api_url = evolution_api_url.rstrip('/')
         self.api_key = api_key
         self.instance_name = instance_name
@@ -14,6 +48,18 @@ class WhatsAppService:
             'Content-Type': 'application/json',
             'apikey': api_key
         }
+        # Sessão compartilhada por URL base: reaproveita conexões entre envios
+        self.session = get_session(self.api_url)
+        self.timeout = timeout or DEFAULT_TIMEOUT
+        # Ritmo de envio compartilhado por todos os envios da instância
+        self.rate_limiter = get_rate_limiter(instance_name)
+    
+    def _post_message(self, url, payload):
+        """Enviar uma mensagem respeitando o limitador de taxa da instância"""
+        self.rate_limiter.acquire()
+        response = self.session.post(url, headers=self.headers, json=payload, timeout=self.timeout)
+        self.rate_limiter.record_response(response.status_code, response.headers.get('Retry-After'))
+        return response
     
     def send_text_message(self, phone_number, message):
         """Enviar mensagem de texto via Evolution API"""
@@ -25,7 +71,7 @@ class WhatsAppService:
         }
         
         try:
-            response = requests.post(url, headers=self.headers, json=payload)
+            response = self._post_message(url, payload)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -35,12 +81,9 @@ class WhatsAppService:
         """Enviar mensagem com imagem via Evolution API"""
         url = f"{self.api_url}/message/sendMedia/{self.instance_name}"
         
-        # Se for um caminho local, converter para base64 ou URL
+        # Se for um caminho local, usar o base64 em cache; senão, é uma URL
         if os.path.exists(media_path):
-            with open(media_path, 'rb') as f:
-                import base64
-                media_base64 = base64.b64encode(f.read()).decode()
-                media_url = f"data:image/jpeg;base64,{media_base64}"
+            media_url = media_cache.get_data_uri(media_path)
         else:
             media_url = media_path  # Assumir que é uma URL
         
@@ -52,7 +95,7 @@ class WhatsAppService:
         }
         
         try:
-            response = requests.post(url, headers=self.headers, json=payload)
+            response = self._post_message(url, payload)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -63,132 +106,276 @@ class WhatsAppService:
         url = f"{self.api_url}/instance/connectionState/{self.instance_name}"
         
         try:
-            response = requests.get(url, headers=self.headers)
+            response = self.session.get(url, headers=self.headers, timeout=self.timeout)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             raise Exception(f"Erro ao verificar status: {str(e)}")
 
 class CampaignExecutor:
-    def __init__(self, whatsapp_service):
+    def __init__(self, whatsapp_service, max_workers=None):
         self.whatsapp_service = whatsapp_service
+        self.max_workers = max_workers or EVOLUTION_MAX_CONCURRENCY
     
-    def execute_dispatch(self, dispatch_id):
-        """Executar um disparo específico"""
+    def execute_dispatch(self, dispatch_id, resume_failed=False, failure_status='scheduled',
+                         progress_callback=None):
+        """Executar um disparo específico
+
+        O disparo é assumido com um lease antes do envio, então vários
+        workers podem disputar a mesma fila sem enviar duas vezes. Se a
+        execução falhar, o disparo recebe failure_status ('scheduled' por
+        padrão), desde que o lease ainda seja deste worker. Clientes que já
+        têm log no disparo são pulados, então uma execução interrompida (ou
+        um disparo que falhou, com resume_failed) continua de onde parou.
+        progress_callback recebe o progresso a cada bloco de clientes; um
+        erro levantado por ele interrompe o disparo como qualquer outro.
+        """
         dispatch = CampaignDispatch.query.get(dispatch_id)
         if not dispatch:
             raise Exception(f"Disparo {dispatch_id} não encontrado")
         
-        if dispatch.status != 'scheduled':
-            raise Exception(f"Disparo {dispatch_id} não está agendado")
+        lease_owner = new_lease_owner()
+        statuses = ('scheduled', 'failed') if resume_failed else ('scheduled',)
+        if not claim_dispatch(dispatch_id, lease_owner, statuses):
+            raise DispatchNotClaimable(f"Disparo {dispatch_id} não está agendado")
         
+        try:
+            return self._run_claimed_dispatch(dispatch, lease_owner, progress_callback)
+        except Exception:
+            db.session.rollback()
+            if release_dispatch(dispatch_id, lease_owner, failure_status):
+                response_cache.invalidate(DISPATCHES_TAG)
+            raise
+    
+    def _run_claimed_dispatch(self, dispatch, lease_owner, progress_callback=None):
+        """Enviar as mensagens de um disparo já assumido por este worker"""
+        dispatch_id = dispatch.id
         campaign = dispatch.campaign
         
-        # Buscar clientes do grupo
+        # Buscar clientes do grupo, sem os que já foram processados antes
         customers = self._get_customers_for_dispatch(dispatch)
+        logged = set(db.session.scalars(
+            db.select(MessageLog.customer_id).where(MessageLog.dispatch_id == dispatch_id)
+        ))
+        recipients = [
+            DispatchRecipient(c.id, c.phone, c.name, c.preferred_items, c.segment)
+            for c in customers
+            if c.id not in logged
+        ]
+        
+        # Personalizar todas as mensagens com o template compilado uma única vez
+        template = compile_template(campaign.message_template, campaign.coupon_code, strict=False)
+        messages = template.render_many(recipients)
+        
+        # Valores fixos do log; os objetos expiram a cada commit do writer
+        log_fields = {
+            'campaign_id': campaign.id,
+            'dispatch_id': dispatch.id,
+            'image_path': campaign.image_path
+        }
+        writer = MessageLogWriter(dispatch.id, dispatch.dispatch_number, lease_owner=lease_owner)
+        
+        # Recalcular contadores pelos logs já gravados, com a mesma guarda de
+        # lease das demais gravações; o writer os incrementa a cada lote
+        writer.set_counters(*self._count_logged_messages(dispatch_id))
         
-        success_count = 0
-        failed_count = 0
+        self._send_with_checkpoints(recipients, messages, log_fields, writer, progress_callback)
+        writer.flush()
         
-        for customer in customers:
+        # Atualizar status do disparo, encerrando o lease, com os contadores
+        # recalculados pelos logs
+        if not release_dispatch(dispatch_id, lease_owner, 'sent', sent_date=datetime.utcnow(),
+                                **logged_counters(dispatch_id)):
+            raise DispatchLeaseLost(f"Lease do disparo {dispatch_id} foi perdido")
+        response_cache.invalidate(DISPATCHES_TAG)
+        
+        return {
+            'dispatch_id': dispatch_id,
+            'success_count': writer.success_count,
+            'failed_count': writer.failed_count,
+            'total_customers': len(customers),
+            'resumed_count': len(logged)
+        }
+    
+    def _count_logged_messages(self, dispatch_id):
+        """Mensagens enviadas e com falha já registradas no disparo
+
+        Logs ainda 'pending' (envio interrompido, resultado incerto) não contam.
+        """
+        success, failed = db.session.query(
+            db.func.count(MessageLog.id).filter(MessageLog.status == 'sent'),
+            db.func.count(MessageLog.id).filter(MessageLog.status == 'failed')
+        ).filter(MessageLog.dispatch_id == dispatch_id).one()
+        return success, failed
+    
+    def _build_reservation(self, log_fields, recipient, message):
+        """Log 'pending' gravado antes do envio, como dicionário para INSERT em massa"""
+        return {
+            'campaign_id': log_fields['campaign_id'],
+            'customer_id': recipient.id,
+            'dispatch_id': log_fields['dispatch_id'],
+            'phone_number': recipient.phone,
+            'message_content': message,
+            'image_path': None,
+            'sent_date': None,
+            'status': 'pending',
+            'whatsapp_message_id': None,
+            'error_message': None,
+            'segment': recipient.segment or '',
+            'created_at': datetime.utcnow()
+        }
+    
+    def _build_log_row(self, log_fields, row, result):
+        """Completar o log reservado com o resultado do envio"""
+        sent = result['status'] == 'sent'
+        
+        return dict(
+            row,
+            image_path=log_fields['image_path'] if sent else None,
+            sent_date=result['sent_date'],
+            status=result['status'],
+            whatsapp_message_id=result['whatsapp_message_id'],
+            error_message=result['error']
+        )
+    
+    def _send_with_checkpoints(self, recipients, messages, log_fields, writer, progress_callback=None):
+        """Enviar mensagens com um pool de threads limitado, reservando cada cliente antes
+
+        Os clientes são reservados em blocos do tamanho do pool, quando a
+        fila cai para esse tamanho. Se o processo cair, ficam 'pending' (com
+        resultado incerto, e não são reenviados) no máximo 2 * max_workers
+        envios mais um lote do writer. Em um erro, os envios que nem
+        começaram são descartados e os resultados dos demais são gravados
+        antes de propagar o erro, inclusive quando o lease foi perdido (o
+        novo dono pula os clientes já reservados). As threads de envio não
+        acessam o banco.
+        """
+        if not recipients:
+            return
+        
+        workers = min(self.max_workers, len(recipients))
+        queue = iter(zip(recipients, messages))
+        in_flight = {}
+        exhausted = False
+        processed = 0
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dispatch') as pool:
             try:
-                # Personalizar mensagem
-                personalized_message = self._personalize_message(
-                    campaign.message_template, 
-                    customer, 
-                    campaign.coupon_code
-                )
-                
-                # Enviar mensagem
-                if campaign.image_path:
+                while True:
+                    while not exhausted and len(in_flight) <= workers:
+                        if progress_callback:
+                            progress_callback({'processed': processed, 'total': len(recipients)})
+                        exhausted = not self._submit_next(pool, queue, workers, in_flight, log_fields, writer)
+                    if not in_flight:
+                        break
+                    
+                    done, _ = wait(in_flight, timeout=writer.time_until_flush(), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        row, recipient = in_flight.pop(future)
+                        writer.add(self._build_log_row(log_fields, row, future.result()), recipient.segment)
+                        processed += 1
+                    writer.flush_if_due()
+            except Exception:
+                self._save_partial_results(in_flight, log_fields, writer)
+                raise
+    
+    def _submit_next(self, pool, queue, count, in_flight, log_fields, writer):
+        """Reservar o próximo bloco de clientes e enviar só os que foram reservados
+
+        Retorna False quando não há mais clientes na fila.
+        """
+        batch = [
+            (recipient, self._build_reservation(log_fields, recipient, message))
+            for recipient, message in islice(queue, count)
+        ]
+        if not batch:
+            return False
+        
+        reserved = writer.reserve([row for _, row in batch])
+        
+        for recipient, row in batch:
+            log_id = reserved.get(recipient.id)
+            if log_id is None:
+                continue
+            row['id'] = log_id
+            future = pool.submit(self._send_to_recipient, recipient, row['message_content'], log_fields['image_path'])
+            in_flight[future] = (row, recipient)
+        return True
+    
+    def _save_partial_results(self, in_flight, log_fields, writer):
+        """Após um erro, liberar as reservas não enviadas e gravar os resultados obtidos"""
+        not_started = [in_flight.pop(future)[0]['id'] for future in list(in_flight) if future.cancel()]
+        wait(in_flight)
+        
+        try:
+            db.session.rollback()
+            for future, (row, recipient) in in_flight.items():
+                writer.add(self._build_log_row(log_fields, row, future.result()), recipient.segment)
+            writer.flush()
+            writer.discard(not_started)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro ao gravar resultados parciais do disparo {writer.dispatch_id}: {str(e)}")
+    
+    def _send_to_recipient(self, recipient, message, image_path):
+        """Enviar a mensagem de um cliente, sem propagar erros"""
+        semaphore = get_instance_semaphore(self.whatsapp_service.instance_name)
+        
+        try:
+            # Enviar mensagem respeitando o limite da instância
+            with semaphore:
+                if image_path:
                     result = self.whatsapp_service.send_media_message(
-                        customer.phone, 
-                        personalized_message, 
-                        campaign.image_path
+                        recipient.phone, 
+                        message, 
+                        image_path
                     )
                 else:
                     result = self.whatsapp_service.send_text_message(
-                        customer.phone, 
-                        personalized_message
+                        recipient.phone, 
+                        message
                     )
-                
-                # Registrar log de sucesso
-                message_log = MessageLog(
-                    campaign_id=campaign.id,
-                    customer_id=customer.id,
-                    dispatch_id=dispatch.id,
-                    phone_number=customer.phone,
-                    message_content=personalized_message,
-                    image_path=campaign.image_path,
-                    sent_date=datetime.utcnow(),
-                    status='sent',
-                    whatsapp_message_id=result.get('key', {}).get('id')
-                )
-                db.session.add(message_log)
-                success_count += 1
-                
-            except Exception as e:
-                # Registrar log de erro
-                message_log = MessageLog(
-                    campaign_id=campaign.id,
-                    customer_id=customer.id,
-                    dispatch_id=dispatch.id,
-                    phone_number=customer.phone,
-                    message_content=personalized_message if 'personalized_message' in locals() else '',
-                    status='failed',
-                    error_message=str(e)
-                )
-                db.session.add(message_log)
-                failed_count += 1
-        
-        # Atualizar status do disparo
-        dispatch.status = 'sent'
-        dispatch.sent_date = datetime.utcnow()
-        dispatch.success_count = success_count
-        dispatch.failed_count = failed_count
-        
-        db.session.commit()
-        
-        return {
-            'dispatch_id': dispatch_id,
-            'success_count': success_count,
-            'failed_count': failed_count,
-            'total_customers': len(customers)
-        }
+            
+            return {
+                'recipient': recipient,
+                'message': message,
+                'status': 'sent',
+                'sent_date': datetime.utcnow(),
+                'whatsapp_message_id': result.get('key', {}).get('id'),
+                'error': None
+            }
+        except Exception as e:
+            return {
+                'recipient': recipient,
+                'message': message,
+                'status': 'failed',
+                'sent_date': None,
+                'whatsapp_message_id': None,
+                'error': str(e)
+            }
     
     def _get_customers_for_dispatch(self, dispatch):
         """Obter clientes para um disparo específico"""
         campaign = dispatch.campaign
         
-        # Buscar clientes do segmento
+        # Grupos materializados no agendamento: leitura indexada do grupo
+        customers = Customer.query.join(
+            CampaignGroupMember, CampaignGroupMember.customer_id == Customer.id
+        ).filter(
+            CampaignGroupMember.campaign_id == campaign.id,
+            CampaignGroupMember.customer_group == dispatch.customer_group
+        ).order_by(Customer.id).all()
+        
+        if customers or CampaignGroupMember.query.filter_by(campaign_id=campaign.id).first():
+            return customers
+        
+        # Disparos agendados antes da materialização: grupo pelo segmento atual
         query = Customer.query
         if campaign.target_segment and campaign.target_segment != 'all':
             query = query.filter(Customer.segment == campaign.target_segment)
         
-        all_customers = query.all()
-        
-        # Dividir em grupos de 300 e pegar o grupo específico
-        start_index = (dispatch.customer_group - 1) * 300
-        end_index = start_index + 300
-        
-        return all_customers[start_index:end_index]
-    
-    def _personalize_message(self, template, customer, coupon_code):
-        """Personalizar mensagem com dados do cliente"""
-        personalized = template
-        
-        # Substituir variáveis
-        replacements = {
-            '{nome_cliente}': customer.name,
-            '{cupom_desconto}': coupon_code or 'DESCONTO10',
-            '{link_cardapio}': 'https://seu-cardapio.com.br',
-            '{sabor_preferido}': customer.preferred_items or 'sushi'
-        }
-        
-        for placeholder, value in replacements.items():
-            personalized = personalized.replace(placeholder, str(value))
-        
-        return personalized
+        start_index = (dispatch.customer_group - 1) * CUSTOMER_GROUP_SIZE
+        return query.order_by(Customer.id).offset(start_index).limit(CUSTOMER_GROUP_SIZE).all()
 
 class SocialMediaService:
     def __init__(self):
@@ -0,0 +1,131 @@
+import base64
+import json
+import os
+from collections import namedtuple
+from datetime import datetime
+from src.models.auth import db
+
+# Configurações de paginação das listagens
+PAGINATION_MAX_PER_PAGE = int(os.getenv('PAGINATION_MAX_PER_PAGE', '200'))
+PAGINATION_COUNT_CAP = int(os.getenv('PAGINATION_COUNT_CAP', '10000'))
+
+# exact: COUNT completo; capped: conta até o limite; none: não conta
+COUNT_MODES = ('exact', 'capped', 'none')
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_cursor', 'has_next'])
+
+class PaginationError(ValueError):
+    """Parâmetros de paginação inválidos"""
+
+def encode_cursor(values):
+    """Codificar os valores da chave de ordenação em um cursor opaco"""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token, sort_columns):
+    """Decodificar um cursor, validando-o contra as colunas de ordenação"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise PaginationError('Cursor inválido')
+
+    if not isinstance(values, list) or len(values) != len(sort_columns):
+        raise PaginationError('Cursor inválido')
+
+    try:
+        return [
+            datetime.fromisoformat(value) if isinstance(column.type, db.DateTime) and value is not None else value
+            for column, value in zip(sort_columns, values)
+        ]
+    except (TypeError, ValueError):
+        raise PaginationError('Cursor inválido')
+
+def count_rows(query, mode='exact'):
+    """Contar as linhas da query conforme o modo, retornando (total, limitado)"""
+    if mode == 'none':
+        return None, False
+
+    query = query.order_by(None)
+    if mode == 'capped':
+        # Contar no máximo até o limite, sem percorrer o conjunto inteiro
+        limited = query.with_entities(db.literal(1)).limit(PAGINATION_COUNT_CAP + 1).subquery()
+        total = db.session.query(db.func.count()).select_from(limited).scalar()
+        return min(total, PAGINATION_COUNT_CAP), total > PAGINATION_COUNT_CAP
+
+    return query.count(), False
+
+def keyset_paginate(query, sort_columns, cursor=None, per_page=50, descending=False):
+    """Buscar uma página a partir do cursor, filtrando por (chave, id) em vez de OFFSET
+
+    A última coluna de sort_columns deve ser única (normalmente o id), para
+    que a ordem seja total e nenhuma linha se repita ou se perca entre páginas.
+    """
+    page_query = query.order_by(None)
+
+    if cursor:
+        values = decode_cursor(cursor, sort_columns)
+        key = db.tuple_(*sort_columns)
+        bound = db.tuple_(*[db.literal(value, type_=column.type) for column, value in zip(sort_columns, values)])
+        page_query = page_query.filter(key < bound if descending else key > bound)
+
+    ordering = [column.desc() if descending else column.asc() for column in sort_columns]
+    rows = page_query.add_columns(*sort_columns).order_by(*ordering).limit(per_page + 1).all()
+
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    next_cursor = encode_cursor(list(rows[-1][1:])) if has_next else None
+
+    return KeysetPage([row[0] for row in rows], next_cursor, has_next)
+
+def paginate_query(query, args, sort_keys, default_sort='id', default_per_page=50,
+                   default_order='asc', default_count='exact', cursor_only=False):
+    """Paginar uma listagem pelos argumentos da requisição
+
+    Com o parâmetro `cursor` (vazio na primeira página) a paginação é por
+    keyset, ordenada por `sort` e `order`; sem ele, mantém a paginação por
+    `page` com OFFSET, a menos que `cursor_only` seja usado. Em ambos os
+    modos `count` controla o total. Retorna (itens, bloco de paginação).
+    """
+    per_page = min(max(args.get('per_page', default_per_page, type=int), 1), PAGINATION_MAX_PER_PAGE)
+    count_mode = args.get('count', default_count)
+    if count_mode not in COUNT_MODES:
+        raise PaginationError(f"Modo de contagem inválido: {count_mode}. Use: {', '.join(COUNT_MODES)}")
+
+    cursor = args.get('cursor')
+    if cursor is None and cursor_only:
+        cursor = ''
+
+    if cursor is not None:
+        sort = args.get('sort', default_sort)
+        if sort not in sort_keys:
+            raise PaginationError(f"Ordenação inválida: {sort}. Use: {', '.join(sort_keys)}")
+        descending = args.get('order', default_order) == 'desc'
+
+        page = keyset_paginate(query, sort_keys[sort], cursor, per_page, descending)
+        total, capped = count_rows(query, count_mode)
+        return page.items, {
+            'per_page': per_page,
+            'sort': sort,
+            'order': 'desc' if descending else 'asc',
+            'next_cursor': page.next_cursor,
+            'has_next': page.has_next,
+            'total': total,
+            'total_capped': capped
+        }
+
+    page_number = max(args.get('page', 1, type=int), 1)
+    rows = query.limit(per_page + 1).offset((page_number - 1) * per_page).all()
+    has_next = len(rows) > per_page
+    total, capped = count_rows(query, count_mode)
+
+    return rows[:per_page], {
+        'page': page_number,
+        'per_page': per_page,
+        'total': total,
+        'total_capped': capped,
+        'pages': (total + per_page - 1) // per_page if count_mode == 'exact' else None,
+        'has_next': has_next,
+        'has_prev': page_number > 1
+    }
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+# Configurações de ritmo de envio por instância da Evolution API
+EVOLUTION_RATE_LIMIT = float(os.getenv('EVOLUTION_RATE_LIMIT', '5'))  # mensagens por segundo
+EVOLUTION_RATE_BURST = int(os.getenv('EVOLUTION_RATE_BURST', '10'))
+EVOLUTION_MIN_RATE = float(os.getenv('EVOLUTION_MIN_RATE', '0.5'))
+EVOLUTION_BACKOFF_FACTOR = float(os.getenv('EVOLUTION_BACKOFF_FACTOR', '0.5'))
+EVOLUTION_RECOVERY_STEP = float(os.getenv('EVOLUTION_RECOVERY_STEP', '0.1'))
+# Intervalo mínimo entre duas reduções de taxa e erros 5xx seguidos que contam como limitação
+EVOLUTION_BACKOFF_COOLDOWN = float(os.getenv('EVOLUTION_BACKOFF_COOLDOWN', '2'))
+EVOLUTION_SERVER_ERROR_THRESHOLD = int(os.getenv('EVOLUTION_SERVER_ERROR_THRESHOLD', '3'))
+
+# Janela usada para medir a taxa real de envio
+OBSERVED_RATE_WINDOW = 10.0
+
+def _parse_retry_after(value):
+    """Converter o cabeçalho Retry-After em segundos"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(value)
+        return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class RateLimiter:
+    """Token bucket com ajuste adaptativo (AIMD) da taxa de envio
+
+    A taxa cai multiplicativamente quando a API responde 429, ou vários 5xx
+    seguidos, e volta a subir aos poucos a cada envio bem-sucedido, até o
+    limite configurado. Há no máximo uma redução por intervalo de cooldown,
+    então uma rajada de erros das requisições já em andamento conta uma vez.
+    """
+
+    def __init__(self, max_rate=None, burst=None, min_rate=None,
+                 backoff_factor=None, recovery_step=None, backoff_cooldown=None,
+                 server_error_threshold=None):
+        self.max_rate = max_rate or EVOLUTION_RATE_LIMIT
+        self.burst = burst or EVOLUTION_RATE_BURST
+        self.min_rate = min(min_rate or EVOLUTION_MIN_RATE, self.max_rate)
+        self.backoff_factor = backoff_factor or EVOLUTION_BACKOFF_FACTOR
+        self.recovery_step = recovery_step or EVOLUTION_RECOVERY_STEP
+        self.backoff_cooldown = EVOLUTION_BACKOFF_COOLDOWN if backoff_cooldown is None else backoff_cooldown
+        self.server_error_threshold = server_error_threshold or EVOLUTION_SERVER_ERROR_THRESHOLD
+
+        self.rate = self.max_rate
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.last_backoff_at = None
+        self.consecutive_server_errors = 0
+
+        self.queue_depth = 0
+        self.sent_total = 0
+        self.throttled_total = 0
+        self._recent = deque()
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        """Repor tokens proporcionalmente ao tempo decorrido"""
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(float(self.burst), self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def _trim_recent(self, now):
+        """Descartar os envios que já saíram da janela de medição"""
+        while self._recent and self._recent[0] < now - OBSERVED_RATE_WINDOW:
+            self._recent.popleft()
+
+    def _backoff(self, now):
+        """Reduzir a taxa, no máximo uma vez por intervalo de cooldown"""
+        if self.last_backoff_at is not None and now - self.last_backoff_at < self.backoff_cooldown:
+            return
+        self.last_backoff_at = now
+        self.rate = max(self.min_rate, self.rate * self.backoff_factor)
+        self.tokens = min(self.tokens, 0.0)
+
+    def acquire(self):
+        """Bloquear até haver um token disponível para envio"""
+        with self._condition:
+            self.queue_depth += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+
+                    if now < self.paused_until:
+                        wait = self.paused_until - now
+                    elif self.tokens >= 1:
+                        self.tokens -= 1
+                        self._recent.append(now)
+                        self._trim_recent(now)
+                        return
+                    else:
+                        wait = (1 - self.tokens) / self.rate
+
+                    self._condition.wait(wait)
+            finally:
+                self.queue_depth -= 1
+
+    def record_response(self, status_code, retry_after=None):
+        """Ajustar a taxa conforme a resposta da Evolution API"""
+        with self._condition:
+            now = time.monotonic()
+            if status_code == 429:
+                self.throttled_total += 1
+                self._backoff(now)
+
+                pause = _parse_retry_after(retry_after)
+                if pause:
+                    self.paused_until = max(self.paused_until, now + pause)
+            elif status_code >= 500:
+                # Um 5xx isolado não indica limitação; só erros seguidos reduzem a taxa
+                self.consecutive_server_errors += 1
+                if self.consecutive_server_errors >= self.server_error_threshold:
+                    self.throttled_total += 1
+                    self._backoff(now)
+            elif status_code < 400:
+                self.consecutive_server_errors = 0
+                self.sent_total += 1
+                self.rate = min(self.max_rate, self.rate + self.recovery_step)
+
+            self._condition.notify_all()
+
+    def get_metrics(self):
+        """Métricas atuais do limitador"""
+        with self._condition:
+            now = time.monotonic()
+            self._refill(now)
+            self._trim_recent(now)
+
+            return {
+                'current_rate': round(self.rate, 3),
+                'max_rate': self.max_rate,
+                'min_rate': self.min_rate,
+                'burst': self.burst,
+                'available_tokens': round(self.tokens, 3),
+                'observed_rate': round(len(self._recent) / OBSERVED_RATE_WINDOW, 3),
+                'queue_depth': self.queue_depth,
+                'paused_for_seconds': round(max(0.0, self.paused_until - now), 3),
+                'sent_total': self.sent_total,
+                'throttled_total': self.throttled_total
+            }
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(instance_name):
+    """Obter o limitador compartilhado do processo para uma instância"""
+    with _limiters_lock:
+        limiter = _limiters.get(instance_name)
+        if limiter is None:
+            limiter = RateLimiter()
+            _limiters[instance_name] = limiter
+        return limiter
+
+def get_all_metrics():
+    """Métricas de todos os limitadores ativos, por instância"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.get_metrics() for name, limiter in limiters.items()}
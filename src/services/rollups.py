@@ -0,0 +1,117 @@
+import click
+from collections import Counter
+from flask.cli import with_appcontext
+from src.models.auth import db
+from src.models.campaign import (
+    MessageLog, CampaignDispatch, Customer, CampaignMessageRollup, SegmentDailyRollup,
+    MESSAGE_RESULT_STATUSES
+)
+from src.services.db_utils import dialect_insert
+
+def _upsert_increments(model, key_columns, conflict_columns, counts):
+    """Somar contagens às linhas de rollup, criando as que não existem"""
+    if not counts:
+        return
+    
+    table = model.__table__
+    rows = [
+        dict(zip(key_columns, key), message_count=count)
+        for key, count in counts.items()
+    ]
+    
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=conflict_columns,
+        set_={'message_count': table.c.message_count + stmt.excluded.message_count}
+    )
+    db.session.execute(stmt, rows)
+
+class RollupCounter:
+    """Acumula incrementos de rollup para gravar junto com os logs"""
+    
+    CAMPAIGN_KEY = ('campaign_id', 'dispatch_id', 'dispatch_number', 'status')
+    CAMPAIGN_CONFLICT = ['campaign_id', 'dispatch_id', 'status']
+    SEGMENT_KEY = ('segment', 'day', 'status')
+    
+    def __init__(self):
+        self.campaign_counts = Counter()
+        self.segment_counts = Counter()
+    
+    def add(self, row, dispatch_number, segment):
+        """Contabilizar um log de mensagem"""
+        day = (row.get('sent_date') or row['created_at']).date()
+        self.campaign_counts[(row['campaign_id'], row['dispatch_id'], dispatch_number, row['status'])] += 1
+        self.segment_counts[(segment or '', day, row['status'])] += 1
+    
+    def apply(self):
+        """Gravar os incrementos na transação atual, sem commit"""
+        _upsert_increments(CampaignMessageRollup, self.CAMPAIGN_KEY, self.CAMPAIGN_CONFLICT, self.campaign_counts)
+        _upsert_increments(SegmentDailyRollup, self.SEGMENT_KEY, list(self.SEGMENT_KEY), self.segment_counts)
+        self.campaign_counts.clear()
+        self.segment_counts.clear()
+
+def _log_day():
+    """Dia do log: envio, ou criação para mensagens que falharam"""
+    log_date = db.func.coalesce(MessageLog.sent_date, MessageLog.created_at)
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return db.func.date(log_date)
+    return db.cast(log_date, db.Date)
+
+def rebuild_rollups():
+    """Recalcular todos os rollups a partir dos logs de mensagens"""
+    CampaignMessageRollup.query.delete()
+    SegmentDailyRollup.query.delete()
+    
+    campaign_select = db.select(
+        MessageLog.campaign_id,
+        MessageLog.dispatch_id,
+        CampaignDispatch.dispatch_number,
+        MessageLog.status,
+        db.func.count(MessageLog.id)
+    ).join(
+        CampaignDispatch, CampaignDispatch.id == MessageLog.dispatch_id
+    ).where(
+        # Reservas 'pending' não entram nos rollups incrementais
+        MessageLog.status.in_(MESSAGE_RESULT_STATUSES)
+    ).group_by(
+        MessageLog.campaign_id,
+        MessageLog.dispatch_id,
+        CampaignDispatch.dispatch_number,
+        MessageLog.status
+    )
+    db.session.execute(
+        db.insert(CampaignMessageRollup).from_select(
+            ['campaign_id', 'dispatch_id', 'dispatch_number', 'status', 'message_count'],
+            campaign_select
+        )
+    )
+    
+    # Vale o segmento gravado no envio, como nos incrementos; logs antigos,
+    # sem essa coluna preenchida, usam o segmento atual do cliente
+    day = _log_day()
+    segment = db.func.coalesce(MessageLog.segment, Customer.segment, '')
+    segment_select = db.select(
+        segment,
+        day,
+        MessageLog.status,
+        db.func.count(MessageLog.id)
+    ).outerjoin(
+        Customer, Customer.id == MessageLog.customer_id
+    ).where(
+        MessageLog.status.in_(MESSAGE_RESULT_STATUSES)
+    ).group_by(segment, day, MessageLog.status)
+    db.session.execute(
+        db.insert(SegmentDailyRollup).from_select(
+            ['segment', 'day', 'status', 'message_count'],
+            segment_select
+        )
+    )
+    
+    db.session.commit()
+
+@click.command('rebuild-rollups')
+@with_appcontext
+def rebuild_rollups_command():
+    """Recalcular as tabelas de rollup de mensagens."""
+    rebuild_rollups()
+    click.echo('Rollups recalculados')
@@ -0,0 +1,204 @@
+import logging
+import re
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.exc import SQLAlchemyError
+from src.models.auth import db
+from src.models.campaign import Customer
+
+logger = logging.getLogger(__name__)
+
+# Índice de busca de clientes: FTS5 no SQLite, pg_trgm no PostgreSQL
+FTS_TABLE = 'customers_fts'
+PHONE_SEPARATORS = (' ', '-', '(', ')', '+', '.', '/')
+PHONE_QUERY_PATTERN = re.compile(r'[\d\s()+\-./]+')
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+# Backend ativo, definido por ensure_search_index()
+_search_backend = None
+
+def normalize_phone(value):
+    """Manter só os dígitos de um telefone"""
+    return re.sub(r'\D', '', value or '')
+
+def _is_phone_query(query):
+    return bool(PHONE_QUERY_PATTERN.fullmatch(query)) and len(normalize_phone(query)) >= 2
+
+def _sqlite_phone_digits(column):
+    """Expressão SQL que remove separadores do telefone, compatível com triggers"""
+    expression = column
+    for separator in PHONE_SEPARATORS:
+        expression = f"REPLACE({expression}, '{separator}', '')"
+    return expression
+
+def _sqlite_phone_local(column):
+    """Telefone sem o código do país, para buscar pelo DDD"""
+    digits = _sqlite_phone_digits(column)
+    return f"CASE WHEN {digits} LIKE '55%' AND length({digits}) >= 12 THEN substr({digits}, 3) ELSE {digits} END"
+
+def _sqlite_values(prefix):
+    column = f'{prefix}.' if prefix else ''
+    return (
+        f"{column}id, {column}name, coalesce({column}email, ''), "
+        f"{_sqlite_phone_digits(column + 'phone')}, {_sqlite_phone_local(column + 'phone')}"
+    )
+
+FTS_COLUMNS = 'rowid, name, email, phone_digits, phone_local'
+
+def _sqlite_statements():
+    # Tabela sem conteúdo próprio: guarda só o índice, os dados ficam em customers
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"name, email, phone_digits, phone_local, content='', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON customers BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_COLUMNS}) VALUES ({_sqlite_values('new')}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON customers BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, {FTS_COLUMNS}) VALUES ('delete', {_sqlite_values('old')}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, email, phone ON customers BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, {FTS_COLUMNS}) VALUES ('delete', {_sqlite_values('old')}); "
+        f"INSERT INTO {FTS_TABLE}({FTS_COLUMNS}) VALUES ({_sqlite_values('new')}); END"
+    ]
+
+POSTGRES_PHONE_DIGITS = "regexp_replace(phone, '[^0-9]', '', 'g')"
+
+POSTGRES_STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_customers_name_trgm ON customers USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_customers_email_trgm ON customers USING gin (email gin_trgm_ops)",
+    f"CREATE INDEX IF NOT EXISTS ix_customers_phone_digits_trgm ON customers USING gin (({POSTGRES_PHONE_DIGITS}) gin_trgm_ops)"
+]
+
+def _populate_fts():
+    db.session.execute(db.text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')"))
+    db.session.execute(db.text(
+        f"INSERT INTO {FTS_TABLE}({FTS_COLUMNS}) SELECT {_sqlite_values(None)} FROM customers"
+    ))
+
+def ensure_search_index():
+    """Criar o índice de busca de clientes, se o banco suportar
+
+    No SQLite o índice FTS5 é mantido por triggers, então importações e
+    edições já o atualizam. No PostgreSQL os índices de trigramas são
+    mantidos pelo próprio banco.
+    """
+    global _search_backend
+    dialect = db.engine.dialect.name
+
+    try:
+        if dialect == 'sqlite':
+            existing = db.session.execute(
+                db.text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+                {'name': FTS_TABLE}
+            ).first()
+            for statement in _sqlite_statements():
+                db.session.execute(db.text(statement))
+            if not existing:
+                _populate_fts()
+            db.session.commit()
+            _search_backend = 'fts5'
+        elif dialect == 'postgresql':
+            for statement in POSTGRES_STATEMENTS:
+                db.session.execute(db.text(statement))
+            db.session.commit()
+            _search_backend = 'trgm'
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        _search_backend = None
+        logger.error(f"Índice de busca indisponível, usando busca por ilike: {str(e)}")
+
+    return _search_backend
+
+def _fts_match(query):
+    """Montar a expressão MATCH do FTS5 com busca por prefixo"""
+    if _is_phone_query(query):
+        return '{phone_digits phone_local} : "' + normalize_phone(query) + '"*'
+
+    tokens = TOKEN_PATTERN.findall(query)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+def _apply_fts(customers_query, query):
+    match = _fts_match(query)
+    if not match:
+        return customers_query
+
+    fts = db.table(FTS_TABLE, db.column('rowid'))
+    return customers_query.join(
+        fts, fts.c.rowid == Customer.id
+    ).filter(
+        db.text(f'{FTS_TABLE} MATCH :search_match').bindparams(search_match=match)
+    ).order_by(
+        # Nome pesa mais que telefone e e-mail na relevância
+        db.text(f'bm25({FTS_TABLE}, 10.0, 3.0, 5.0, 5.0)'),
+        Customer.id
+    )
+
+def _apply_trgm(customers_query, query):
+    if _is_phone_query(query):
+        digits = normalize_phone(query)
+        phone_digits = db.literal_column(POSTGRES_PHONE_DIGITS)
+        return customers_query.filter(
+            db.or_(
+                phone_digits.startswith(digits, autoescape=True),
+                phone_digits.startswith('55' + digits, autoescape=True)
+            )
+        ).order_by(Customer.id)
+
+    tokens = TOKEN_PATTERN.findall(query)
+    if not tokens:
+        return customers_query
+
+    for token in tokens:
+        customers_query = customers_query.filter(
+            db.or_(
+                Customer.name.icontains(token, autoescape=True),
+                Customer.email.icontains(token, autoescape=True)
+            )
+        )
+
+    similarity = db.func.greatest(
+        db.func.similarity(Customer.name, query),
+        db.func.similarity(db.func.coalesce(Customer.email, ''), query)
+    )
+    return customers_query.order_by(similarity.desc(), Customer.id)
+
+def apply_customer_search(customers_query, query):
+    """Filtrar e ordenar por relevância uma query de clientes pelo texto buscado"""
+    query = (query or '').strip()
+    if not query:
+        return customers_query
+
+    if _search_backend == 'fts5':
+        return _apply_fts(customers_query, query)
+    if _search_backend == 'trgm':
+        return _apply_trgm(customers_query, query)
+
+    return customers_query.filter(
+        db.or_(
+            Customer.name.ilike(f'%{query}%'),
+            Customer.phone.ilike(f'%{query}%'),
+            Customer.email.ilike(f'%{query}%')
+        )
+    )
+
+def rebuild_search_index():
+    """Recriar o índice de busca a partir da tabela de clientes"""
+    backend = ensure_search_index()
+    if backend == 'fts5':
+        _populate_fts()
+        db.session.commit()
+    elif backend == 'trgm':
+        for index in ('ix_customers_name_trgm', 'ix_customers_email_trgm', 'ix_customers_phone_digits_trgm'):
+            db.session.execute(db.text(f'REINDEX INDEX {index}'))
+        db.session.commit()
+    return backend
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Recriar o índice de busca de clientes."""
+    backend = rebuild_search_index()
+    if backend:
+        click.echo(f'Índice de busca recriado ({backend})')
+    else:
+        click.echo('Índice de busca indisponível neste banco')
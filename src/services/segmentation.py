@@ -0,0 +1,62 @@
+from collections import namedtuple
+from src.models.auth import db
+from src.models.campaign import Customer
+from src.services.db_utils import chunked
+
+# Limite de parâmetros por consulta IN na segmentação incremental
+SEGMENT_UPDATE_CHUNK = 500
+
+DEFAULT_SEGMENT = 'standard'
+
+# Regra de segmentação: a condição recebe o modelo e devolve uma expressão SQL
+SegmentRule = namedtuple('SegmentRule', ['segment', 'condition'])
+
+# Regras avaliadas em ordem; vale a primeira que o cliente atender
+SEGMENT_RULES = [
+    SegmentRule('high_ticket', lambda c: c.average_ticket >= 100),
+    SegmentRule('frequent', lambda c: c.order_frequency >= 8),  # 8+ pedidos por mês
+    SegmentRule('location_based', lambda c: db.and_(c.location.isnot(None), c.location != '')),
+]
+
+def register_segment_rule(segment, condition, position=None):
+    """Adicionar uma regra de segmentação, opcionalmente numa posição"""
+    rule = SegmentRule(segment, condition)
+    if position is None:
+        SEGMENT_RULES.append(rule)
+    else:
+        SEGMENT_RULES.insert(position, rule)
+    return rule
+
+def segment_expression(rules=None):
+    """Expressão CASE que calcula o segmento de cada cliente"""
+    rules = SEGMENT_RULES if rules is None else rules
+    if not rules:
+        return db.literal(DEFAULT_SEGMENT)
+    
+    return db.case(
+        *[(rule.condition(Customer), rule.segment) for rule in rules],
+        else_=DEFAULT_SEGMENT
+    )
+
+def segment_customers(phones=None, rules=None):
+    """Segmentar clientes com um UPDATE ... CASE no banco, sem commit
+
+    Sem telefones, todos os clientes são reavaliados; com telefones, só os
+    clientes informados (modo incremental, usado na importação).
+    """
+    segment = segment_expression(rules)
+    
+    def run_update(*filters):
+        stmt = db.update(Customer).where(
+            Customer.segment.is_distinct_from(segment),
+            *filters
+        ).values(segment=segment)
+        return db.session.execute(stmt, execution_options={'synchronize_session': False}).rowcount
+    
+    if phones is None:
+        return run_update()
+    
+    updated = 0
+    for chunk in chunked(list(phones), SEGMENT_UPDATE_CHUNK):
+        updated += run_update(Customer.phone.in_(chunk))
+    return updated
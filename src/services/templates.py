@@ -0,0 +1,122 @@
+import re
+from functools import lru_cache
+
+# Variáveis aceitas nos templates de mensagem
+TEMPLATE_VARIABLES = ('nome_cliente', 'cupom_desconto', 'link_cardapio', 'sabor_preferido')
+
+DEFAULT_COUPON_CODE = 'DESCONTO10'
+DEFAULT_MENU_LINK = 'https://seu-cardapio.com.br'
+DEFAULT_FLAVOR = 'sushi'
+
+PLACEHOLDER_PATTERN = re.compile(r'\{(\w+)\}')
+
+class TemplateError(ValueError):
+    """Template de mensagem com variáveis desconhecidas"""
+
+    def __init__(self, unknown_variables):
+        self.unknown_variables = unknown_variables
+        variables = ', '.join('{' + name + '}' for name in unknown_variables)
+        super().__init__(f"Variáveis desconhecidas no template: {variables}")
+
+def _customer_name(customer):
+    return str(customer.name)
+
+def _customer_flavor(customer):
+    return str(customer.preferred_items or DEFAULT_FLAVOR)
+
+class MessageTemplate:
+    """Template de mensagem compilado em segmentos literais e variáveis
+
+    Valores que não dependem do cliente (cupom e link) são resolvidos na
+    compilação, então cada renderização é um único join.
+    """
+
+    def __init__(self, template, coupon_code=None, strict=True):
+        self.template = template
+        self.coupon_code = coupon_code
+        self.segments = self._compile(template, coupon_code, strict)
+
+    @staticmethod
+    def _compile(template, coupon_code, strict):
+        static_values = {
+            'cupom_desconto': str(coupon_code or DEFAULT_COUPON_CODE),
+            'link_cardapio': DEFAULT_MENU_LINK
+        }
+        customer_values = {
+            'nome_cliente': _customer_name,
+            'sabor_preferido': _customer_flavor
+        }
+
+        unknown = []
+        segments = []
+        position = 0
+
+        def add_literal(text):
+            if not text:
+                return
+            if segments and isinstance(segments[-1], str):
+                segments[-1] += text
+            else:
+                segments.append(text)
+
+        for match in PLACEHOLDER_PATTERN.finditer(template):
+            add_literal(template[position:match.start()])
+            name = match.group(1)
+
+            if name in customer_values:
+                segments.append(customer_values[name])
+            elif name in static_values:
+                add_literal(static_values[name])
+            else:
+                # Variáveis desconhecidas ficam no texto como estão
+                if name not in unknown:
+                    unknown.append(name)
+                add_literal(match.group(0))
+
+            position = match.end()
+
+        add_literal(template[position:])
+
+        if strict and unknown:
+            raise TemplateError(unknown)
+
+        return segments
+
+    @property
+    def variables(self):
+        """Variáveis usadas no template, na ordem em que aparecem"""
+        seen = []
+        for name in PLACEHOLDER_PATTERN.findall(self.template):
+            if name not in seen:
+                seen.append(name)
+        return seen
+
+    def render(self, customer):
+        """Renderizar a mensagem de um cliente"""
+        return ''.join(
+            segment if isinstance(segment, str) else segment(customer)
+            for segment in self.segments
+        )
+
+    def render_many(self, customers):
+        """Renderizar as mensagens de vários clientes de uma vez"""
+        segments = self.segments
+        if len(segments) == 1 and isinstance(segments[0], str):
+            return [segments[0]] * len(customers)
+
+        return [
+            ''.join([
+                segment if isinstance(segment, str) else segment(customer)
+                for segment in segments
+            ])
+            for customer in customers
+        ]
+
+@lru_cache(maxsize=128)
+def compile_template(template, coupon_code=None, strict=True):
+    """Compilar um template, reaproveitando compilações anteriores"""
+    return MessageTemplate(template, coupon_code, strict)
+
+def validate_template(template):
+    """Validar as variáveis de um template, levantando TemplateError"""
+    compile_template(template, None, True)
@@ -0,0 +1,146 @@
+import os
+from datetime import date, datetime, time, timedelta
+from src.models.auth import db
+from src.models.campaign import MessageLog, SegmentDailyRollup
+
+# Granularidades aceitas nas séries de mensagens
+TIMESERIES_BUCKETS = ('hour', 'day', 'week', 'month')
+TIMESERIES_MAX_HOURLY_DAYS = int(os.getenv('TIMESERIES_MAX_HOURLY_DAYS', '7'))
+# Limite de períodos por série, já que a série é montada sem lacunas em memória
+TIMESERIES_MAX_BUCKETS = int(os.getenv('TIMESERIES_MAX_BUCKETS', '1000'))
+# Folga nos extremos do calendário para as contas de início e fim de período
+TIMESERIES_MIN_DAY = date.min + timedelta(days=7)
+TIMESERIES_MAX_DAY = date.max - timedelta(days=31)
+
+def day_bounds(start_day, end_day=None):
+    """Intervalo semiaberto [início, fim) em datetime cobrindo os dias informados"""
+    end_day = end_day or start_day
+    return (
+        datetime.combine(start_day, time.min),
+        datetime.combine(end_day + timedelta(days=1), time.min)
+    )
+
+def bucket_start(value, bucket):
+    """Início do período que contém a data informada"""
+    if bucket == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    if bucket == 'week':
+        return value - timedelta(days=value.weekday())
+    if bucket == 'month':
+        return value.replace(day=1)
+    return value
+
+def _next_bucket(value, bucket):
+    if bucket == 'hour':
+        return value + timedelta(hours=1)
+    if bucket == 'week':
+        return value + timedelta(days=7)
+    if bucket == 'month':
+        return (value.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return value + timedelta(days=1)
+
+def _bucket_count(first_day, last_day, bucket):
+    """Quantidade de períodos da série entre os dois dias"""
+    if bucket == 'week':
+        return ((last_day - bucket_start(first_day, 'week')).days // 7) + 1
+    if bucket == 'month':
+        return (last_day.year - first_day.year) * 12 + last_day.month - first_day.month + 1
+    return (last_day - first_day).days + 1
+
+def count_messages_on(day):
+    """Mensagens enviadas em um dia, lidas da tabela de contagem diária"""
+    total = db.session.query(
+        db.func.coalesce(db.func.sum(SegmentDailyRollup.message_count), 0)
+    ).filter(
+        SegmentDailyRollup.day == day,
+        SegmentDailyRollup.status == 'sent'
+    ).scalar()
+    return int(total)
+
+def _daily_counts(start_day, end_day):
+    """Contagens por dia e status vindas da tabela de contagem diária"""
+    rows = db.session.query(
+        SegmentDailyRollup.day,
+        SegmentDailyRollup.status,
+        db.func.sum(SegmentDailyRollup.message_count)
+    ).filter(
+        SegmentDailyRollup.day >= start_day,
+        SegmentDailyRollup.day < end_day + timedelta(days=1)
+    ).group_by(
+        SegmentDailyRollup.day,
+        SegmentDailyRollup.status
+    ).all()
+    return [(day, status, int(count)) for day, status, count in rows]
+
+def _hour_expression():
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return db.func.strftime('%Y-%m-%d %H:00:00', MessageLog.sent_date)
+    return db.func.date_trunc('hour', MessageLog.sent_date)
+
+def _hourly_counts(start_day, end_day):
+    """Contagens por hora, direto dos logs com filtro por faixa de sent_date
+
+    Só mensagens enviadas têm sent_date, então a série horária não traz falhas.
+    """
+    start, end = day_bounds(start_day, end_day)
+    hour = _hour_expression()
+    rows = db.session.query(
+        hour,
+        db.func.count(MessageLog.id)
+    ).filter(
+        MessageLog.sent_date >= start,
+        MessageLog.sent_date < end
+    ).group_by(hour).all()
+
+    counts = []
+    for value, count in rows:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        counts.append((value, 'sent', count))
+    return counts
+
+def get_message_timeseries(start_day, end_day, bucket='day'):
+    """Série de mensagens enviadas e com falha por período, sem lacunas"""
+    if bucket not in TIMESERIES_BUCKETS:
+        raise ValueError(f"Granularidade inválida: {bucket}. Use: {', '.join(TIMESERIES_BUCKETS)}")
+    if end_day < start_day:
+        raise ValueError('A data final deve ser igual ou posterior à inicial')
+    if start_day < TIMESERIES_MIN_DAY or end_day > TIMESERIES_MAX_DAY:
+        raise ValueError(
+            f'Datas fora do intervalo suportado ({TIMESERIES_MIN_DAY.isoformat()} a {TIMESERIES_MAX_DAY.isoformat()})'
+        )
+
+    if bucket == 'hour':
+        if (end_day - start_day).days >= TIMESERIES_MAX_HOURLY_DAYS:
+            raise ValueError(f'Séries por hora aceitam no máximo {TIMESERIES_MAX_HOURLY_DAYS} dias')
+    elif _bucket_count(start_day, end_day, bucket) > TIMESERIES_MAX_BUCKETS:
+        raise ValueError(
+            f'A série aceita no máximo {TIMESERIES_MAX_BUCKETS} períodos; '
+            f'reduza o intervalo ou use uma granularidade maior'
+        )
+
+    if bucket == 'hour':
+        counts = _hourly_counts(start_day, end_day)
+        first, last = day_bounds(start_day, end_day)
+        last -= timedelta(hours=1)
+    else:
+        counts = _daily_counts(start_day, end_day)
+        first, last = start_day, end_day
+
+    series = {}
+    period = bucket_start(first, bucket)
+    while period <= last:
+        series[period] = {'sent': 0, 'failed': 0}
+        period = _next_bucket(period, bucket)
+
+    for value, status, count in counts:
+        entry = series.get(bucket_start(value, bucket))
+        if entry is not None and status in entry:
+            entry[status] += count
+
+    return [{
+        'period_start': period.isoformat(),
+        'sent': entry['sent'],
+        'failed': entry['failed'],
+        'total': entry['sent'] + entry['failed']
+    } for period, entry in series.items()]